@@ -13,12 +13,17 @@ import requests
 import pandas as pd
 import numpy as np
 import warnings
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import StandardScaler
+import json
+import threading
+import tempfile
+from collections import OrderedDict
 from datetime import date
 
 # Plotly + HTML component for legend-hover interactivity
 import plotly.graph_objects as go
+from sklearn.cluster import KMeans
+from sklearn.decomposition import PCA
+from sklearn.manifold import Isomap
 import plotly.io as pio
 import uuid
 import streamlit.components.v1 as components
@@ -49,10 +54,32 @@ if 'dna_df' not in st.session_state:
     st.session_state.dna_df = None
 if 'matches' not in st.session_state:
     st.session_state.matches = None
+if 'matches_page' not in st.session_state:
+    st.session_state.matches_page = 0
+if 'match_query' not in st.session_state:
+    st.session_state.match_query = None
 if 'unknown_age_count' not in st.session_state:
     st.session_state.unknown_age_count = 0
 if 'analysis_pos' not in st.session_state:
     st.session_state.analysis_pos = None
+if 'analysis_metric_space' not in st.session_state:
+    st.session_state.analysis_metric_space = "Standard"
+if 'search_profile' not in st.session_state:
+    st.session_state.search_profile = None
+if 'composite_matches' not in st.session_state:
+    st.session_state.composite_matches = None
+if 'squad_replacements' not in st.session_state:
+    st.session_state.squad_replacements = None
+if 'knn_explore' not in st.session_state:
+    st.session_state.knn_explore = None
+if 'trajectory_matches' not in st.session_state:
+    st.session_state.trajectory_matches = None
+if 'query_results' not in st.session_state:
+    st.session_state.query_results = None
+if 'query_page' not in st.session_state:
+    st.session_state.query_page = 0
+if 'map_pool' not in st.session_state:
+    st.session_state.map_pool = None
 
 # --- 3. CORE & POSITIONAL CONFIGURATIONS ---
 import os
@@ -100,37 +127,46 @@ COMPETITION_SEASONS = {
 
 DOMESTIC_LEAGUE_IDS = [4, 5, 51, 65, 1385, 166]
 SCOTTISH_LEAGUE_IDS = [51]
+LEAGUE_FILTERS = {"All Leagues": None, "Domestic Leagues": DOMESTIC_LEAGUE_IDS, "Scottish Leagues": SCOTTISH_LEAGUE_IDS}
 
 # Archetype definitions
+# Similarity weights: each archetype's key_metrics (its most defining identity metrics) are weighted
+# key_weight and its other identity metrics 1.0; explicit per-metric "metric_weights" override both.
 STRIKER_ARCHETYPES = {
     "Poacher (Fox in the Box)": {
         "description": "A clinical finisher who thrives in the penalty area with instinctive movement and a high shot volume. Minimal involvement in build-up play outside the final third. They prioritize shooting over passing.",
         "identity_metrics": ['npg_90', 'np_xg_90', 'np_shots_90', 'touches_inside_box_90', 'conversion_ratio', 'np_xg_per_shot', 'shot_touch_ratio', 'op_xgchain_90'],
+        "key_metrics": ['npg_90', 'np_xg_90', 'touches_inside_box_90'],
         "key_weight": 1.7
     },
     "Target Man": {
         "description": "A physically dominant forward with a strong aerial presence, excels at holding up the ball and bringing teammates into play. They are a focal point for long balls and physical duels.",
         "identity_metrics": ['aerial_wins_90', 'aerial_ratio', 'fouls_won_90', 'op_xgbuildup_90', 'carries_90', 'touches_inside_box_90', 'long_balls_90', 'passing_ratio'],
+        "key_metrics": ['aerial_wins_90', 'aerial_ratio', 'fouls_won_90'],
         "key_weight": 1.6
     },
     "Complete Forward": {
         "description": "A well-rounded striker capable of doing everything: finishing, dribbling, linking up play, and making intelligent runs. A central figure in both goal-scoring and chance creation.",
         "identity_metrics": ['npg_90', 'key_passes_90', 'dribbles_90', 'deep_progressions_90', 'op_xgbuildup_90', 'aerial_wins_90', 'op_xgchain_90', 'npxgxa_90'],
+        "key_metrics": ['npg_90', 'npxgxa_90', 'op_xgchain_90'],
         "key_weight": 1.6
     },
     "False 9": {
         "description": "A forward who drops deep into midfield to link play, acting more like a playmaker than a traditional striker. They possess excellent technical skills, vision, and a high xG buildup contribution.",
         "identity_metrics": ['op_xgbuildup_90', 'key_passes_90', 'through_balls_90', 'dribbles_90', 'carries_90', 'xa_90', 'forward_pass_proportion', 'passing_ratio'],
+        "key_metrics": ['op_xgbuildup_90', 'key_passes_90', 'through_balls_90'],
         "key_weight": 1.5
     },
     "Advanced Forward": {
         "description": "A pacey forward who primarily makes runs in behind the defensive line. They thrive on through balls and quick transitions, focusing on getting into dangerous areas to shoot.",
         "identity_metrics": ['deep_progressions_90', 'through_balls_90', 'np_shots_90', 'touches_inside_box_90', 'npg_90', 'np_xg_90', 'dribbles_90', 'npxgxa_90'],
+        "key_metrics": ['deep_progressions_90', 'touches_inside_box_90', 'np_shots_90'],
         "key_weight": 1.6
     },
     "Pressing Forward": {
         "description": "A high-energy striker whose main defensive contribution is to harass and pressure opposition defenders. They have a high work rate and actively participate in winning the ball back.",
         "identity_metrics": ['pressures_90', 'pressure_regains_90', 'counterpressures_90', 'aggressive_actions_90', 'padj_tackles_90', 'fouls_90', 'fhalf_pressures_90', 'fhalf_counterpressures_90'],
+        "key_metrics": ['pressures_90', 'pressure_regains_90', 'counterpressures_90'],
         "key_weight": 1.5
     },
 }
@@ -195,21 +231,25 @@ WINGER_ARCHETYPES = {
     "Goal-Scoring Winger": {
         "description": "A winger focused on cutting inside to shoot and score goals, often functioning as a wide forward. They have a high goal threat and strong dribbling ability.",
         "identity_metrics": ['npg_90', 'np_xg_90', 'np_shots_90', 'touches_inside_box_90', 'np_xg_per_shot', 'dribbles_90', 'over_under_performance_90', 'npxgxa_90', 'op_passes_into_box_90'],
+        "key_metrics": ['npg_90', 'np_xg_90', 'np_shots_90'],
         "key_weight": 1.6
     },
     "Creative Playmaker": {
         "description": "A winger who creates chances for others through key passes, crosses, and assists. They are a primary source of creativity from wide areas and often have a high xG buildup contribution.",
         "identity_metrics": ['xa_90', 'key_passes_90', 'op_passes_into_box_90', 'through_balls_90', 'op_xgbuildup_90', 'deep_progressions_90', 'crosses_90', 'dribbles_90', 'fouls_won_90'],
+        "key_metrics": ['xa_90', 'key_passes_90', 'op_passes_into_box_90'],
         "key_weight": 1.5
     },
     "Traditional Winger": {
         "description": "A winger who focuses on providing width and stretching the opposition defense. Their primary actions are dribbling down the line and delivering crosses into the box.",
         "identity_metrics": ['crosses_90', 'crossing_ratio', 'dribbles_90', 'carry_length', 'deep_progressions_90', 'fouls_won_90', 'op_passes_into_box_90', 'turnovers_90'],
+        "key_metrics": ['crosses_90', 'crossing_ratio', 'dribbles_90'],
         "key_weight": 1.5
     },
     "Inverted Winger": {
         "description": "A winger who plays on the opposite flank of their strong foot, allowing them to cut inside and create. They are defined by a high volume of successful dribbles and a strong role in ball progression and attacking buildup.",
         "identity_metrics": ['dribbles_90', 'dribble_ratio', 'carries_90', 'carry_length', 'deep_progressions_90', 'op_xgbuildup_90', 'op_passes_into_box_90', 'xa_90'],
+        "key_metrics": ['dribbles_90', 'dribble_ratio', 'carries_90'],
         "key_weight": 1.6
     }
 }
@@ -270,31 +310,37 @@ CM_ARCHETYPES = {
     "Deep-Lying Playmaker (Regista)": {
         "description": "A midfielder who dictates tempo from deep positions, excelling in progressive passing and ball distribution to start attacks. They are the team's engine from the defensive half.",
         "identity_metrics": ['op_xgbuildup_90', 'long_balls_90', 'long_ball_ratio', 'forward_pass_proportion', 'passing_ratio', 'through_balls_90', 'op_f3_passes_90', 'carries_90'],
+        "key_metrics": ['op_xgbuildup_90', 'long_balls_90', 'forward_pass_proportion'],
         "key_weight": 1.6
     },
     "Box-to-Box Midfielder (B2B)": {
         "description": "A high-energy midfielder who covers large vertical space on the pitch, contributing heavily in both attack and defense. They are involved in ball progression, tackling, and late runs into the box.",
         "identity_metrics": ['deep_progressions_90', 'carries_90', 'padj_tackles_and_interceptions_90', 'pressures_90', 'npg_90', 'touches_inside_box_90', 'op_xgchain_90', 'offensive_duels_90'],
+        "key_metrics": ['deep_progressions_90', 'padj_tackles_and_interceptions_90', 'op_xgchain_90'],
         "key_weight": 1.6
     },
     "Ball-Winning Midfielder (Destroyer)": {
         "description": "A defensive-minded midfielder who breaks up opposition attacks, screens the defense, and wins possession. They are defined by their tenacity and high volume of defensive actions.",
         "identity_metrics": ['padj_tackles_90', 'padj_interceptions_90', 'pressure_regains_90', 'challenge_ratio', 'aggressive_actions_90', 'fouls_90', 'dribbled_past_90'],
+        "key_metrics": ['padj_tackles_90', 'padj_interceptions_90', 'pressure_regains_90'],
         "key_weight": 1.6
     },
     "Advanced Playmaker (Mezzala)": {
         "description": "A creative midfielder who operates in the half-spaces and creates chances in advanced zones. They are excellent dribblers and key passers who often make runs into the final third.",
         "identity_metrics": ['xa_90', 'key_passes_90', 'op_passes_into_box_90', 'through_balls_90', 'dribbles_90', 'np_shots_90', 'op_xgbuildup_90', 'deep_progressions_90'],
+        "key_metrics": ['xa_90', 'key_passes_90', 'dribbles_90'],
         "key_weight": 1.5
     },
     "Holding Midfielder (Anchor)": {
         "description": "A conservative midfielder who protects the backline and distributes the ball safely and efficiently. They are defined by their positional discipline and high pass completion rate.",
         "identity_metrics": ['padj_interceptions_90', 'passing_ratio', 'op_xgbuildup_90', 'pressures_90', 'challenge_ratio', 'turnovers_90', 'padj_clearances_90', 's_pass_length'],
+        "key_metrics": ['padj_interceptions_90', 'passing_ratio', 'op_xgbuildup_90'],
         "key_weight": 1.5
     },
     "Attacking Midfielder (8.5 Role)": {
         "description": "An aggressive, goal-oriented midfielder who operates closer to the opposition box, focusing on final-third involvement and attacking output, similar to a second striker.",
         "identity_metrics": ['npg_90', 'np_xg_90', 'xa_90', 'key_passes_90', 'touches_inside_box_90', 'np_shots_90', 'op_passes_into_box_90', 'dribbles_90'],
+        "key_metrics": ['npg_90', 'np_xg_90', 'touches_inside_box_90'],
         "key_weight": 1.6
     }
 }
@@ -358,21 +404,25 @@ FULLBACK_ARCHETYPES = {
     "Attacking Fullback": {
         "description": "An offensive-minded full-back with high attacking output, including crosses, key passes, and deep forward runs into the final third to create chances.",
         "identity_metrics": ['xa_90', 'crosses_90', 'op_passes_into_box_90', 'deep_progressions_90', 'key_passes_90', 'op_xgbuildup_90', 'dribbles_90', 'fouls_won_90'],
+        "key_metrics": ['xa_90', 'crosses_90', 'op_passes_into_box_90'],
         "key_weight": 1.5
     },
     "Defensive Fullback": {
         "description": "A traditional full-back with a solid defensive foundation, focusing on preventing attacks through tackling, interceptions, and aerial duels.",
         "identity_metrics": ['padj_tackles_and_interceptions_90', 'challenge_ratio', 'aggressive_actions_90', 'pressures_90', 'aerial_wins_90', 'aerial_ratio', 'dribbled_past_90', 'padj_clearances_90'],
+        "key_metrics": ['padj_tackles_and_interceptions_90', 'challenge_ratio', 'aerial_wins_90'],
         "key_weight": 1.5
     },
     "Modern Wingback": {
         "description": "A high-energy, all-action player who contributes in both defense and attack. They possess high stamina and cover large distances, excelling in both progression and defensive work rate.",
         "identity_metrics": ['deep_progressions_90', 'crosses_90', 'dribbles_90', 'padj_tackles_and_interceptions_90', 'pressures_90', 'xa_90', 'pressure_regains_90', 'op_xgbuildup_90'],
+        "key_metrics": ['deep_progressions_90', 'padj_tackles_and_interceptions_90', 'crosses_90'],
         "key_weight": 1.6
     },
     "Inverted Fullback": {
         "description": "A fullback who moves into central midfield areas when their team has possession, excelling at linking play and progressive passing from deep zones.",
         "identity_metrics": ['passing_ratio', 'deep_progressions_90', 'op_xgbuildup_90', 'carries_90', 'forward_pass_proportion', 'padj_tackles_90', 'padj_interceptions_90', 'dribble_ratio'],
+        "key_metrics": ['passing_ratio', 'op_xgbuildup_90', 'forward_pass_proportion'],
         "key_weight": 1.7
     }
 }
@@ -431,21 +481,25 @@ CB_ARCHETYPES = {
     "Ball-Playing Defender": {
         "description": "A defender comfortable in possession, who initiates attacks from the back with progressive passing, long balls, and carries into midfield. They are defined by their on-ball ability.",
         "identity_metrics": ['op_xgbuildup_90', 'passing_ratio', 'long_balls_90', 'long_ball_ratio', 'forward_pass_proportion', 'carries_90', 'deep_progressions_90', 'op_f3_passes_90'],
+        "key_metrics": ['op_xgbuildup_90', 'long_balls_90', 'forward_pass_proportion'],
         "key_weight": 1.5
     },
     "Stopper": {
         "description": "An aggressive defender who steps out to challenge attackers and win the ball high up the pitch. They rely on their physical and combative qualities to break up play before it reaches the box.",
         "identity_metrics": ['aggressive_actions_90', 'padj_tackles_90', 'challenge_ratio', 'pressures_90', 'aerial_wins_90', 'fouls_90', 'pressure_regains_90', 'dribbled_past_90'],
+        "key_metrics": ['aggressive_actions_90', 'padj_tackles_90', 'challenge_ratio'],
         "key_weight": 1.6
     },
     "Covering Defender": {
         "description": "A defender who reads the game well and relies on superior positioning and interceptions to sweep up behind the defensive line. They are defined by their intelligence and ability to recover the ball with minimal duels.",
         "identity_metrics": ['padj_interceptions_90', 'padj_clearances_90', 'dribbled_past_90', 'pressure_regains_90', 'aerial_ratio', 'passing_ratio', 'turnovers_90', 'average_x_defensive_action'],
+        "key_metrics": ['padj_interceptions_90', 'padj_clearances_90', 'pressure_regains_90'],
         "key_weight": 1.5
     },
     "No-Nonsense Defender": {
         "description": "A physical defender who prioritizes safety and direct action. They excel at aerial duels, clearances, and tackling, with minimal involvement in attacking buildup or ball progression.",
         "identity_metrics": ['padj_clearances_90', 'aerial_wins_90', 'aerial_ratio', 'padj_tackles_90', 'aggressive_actions_90', 'op_xgbuildup_90', 'passing_ratio', 'turnovers_90'],
+        "key_metrics": ['padj_clearances_90', 'aerial_wins_90', 'aerial_ratio'],
         "key_weight": 1.7
     }
 }
@@ -504,6 +558,7 @@ GK_ARCHETYPES = {
             'avg_pass_length', 'long_ball_ratio', 'op_xgbuildup_90', 'defensive_actions_outside_box_90',
             'padj_interceptions_90', 'carries_90', 'passing_ratio'
         ],
+        "key_metrics": ['defensive_actions_outside_box_90', 'op_xgbuildup_90', 'padj_interceptions_90'],
         "key_weight": 1.6
     },
     "Shot-Stopper": {
@@ -512,6 +567,7 @@ GK_ARCHETYPES = {
             'psxg_net_90', 'save_ratio', 'op_saves_90', 'aerial_ratio',
             'aerial_wins_90', 'padj_clearances_90', 'penalty_save_ratio'
         ],
+        "key_metrics": ['psxg_net_90', 'save_ratio', 'op_saves_90'],
         "key_weight": 1.6
     }
 }
@@ -586,6 +642,85 @@ ALL_METRICS_TO_PERCENTILE = sorted(list(set(
     for radar in pos_config['radars'].values() for metric in radar['metrics'].keys()
 )))
 
+METRIC_LABELS = {
+    metric: label for pos_config in reversed(list(POSITIONAL_CONFIGS.values()))
+    for radar in pos_config['radars'].values() for metric, label in radar['metrics'].items()
+}
+
+def metric_label(metric):
+    return METRIC_LABELS.get(metric, metric.replace('_', ' ').title())
+
+COMPOSITE_OBJECTIVES = {'Weighted centroid': 'centroid', 'Max coverage': 'coverage'}
+SEARCH_MODES = {'Find Similar Players': 'similar', 'Find Potential Upgrades': 'upgrade', 'Find Pareto Upgrades': 'pareto'}
+# Search scopes: how many of the most recent canonical seasons each scope covers (None = all)
+SEARCH_SCOPES = {'Last Season Only': 1, 'Last 2 Seasons': 2, 'All Historical Data': None}
+BLENDED_SEASON_ID = -1
+MATCHES_PAGE_SIZE = 10
+BATCH_CHUNK_ROWS = 4096  # pool rows scored per matrix-matrix product in batch searches
+ANN_MIN_POOL = 5000  # smaller entries and search pools are always scored exactly
+ANN_PROBE_FRACTION = 0.1  # share of inverted lists scanned per approximate query
+ANN_RECALL_QUERIES = 200
+SIMILARITY_MEASURES = ("Weighted Cosine", "Standardised Euclidean", "Mahalanobis")
+MIN_METRIC_OVERLAP = 0.75  # share of an archetype's metrics both players must have data for to be compared
+PARETO_DOMINANCE_SHARE = 0.6  # default share of identity metrics a Pareto upgrade must beat the target on
+SKYLINE_BLOCK_SIZE = 256
+MMR_POOL_SIZE = 300  # best candidates considered by the diversity re-rank
+CUSTOM_PROFILES_PATH = os.getenv("CUSTOM_PROFILES_PATH", "custom_profiles.json")
+RESULT_CACHE_SIZE = 256  # score vectors / archetype detections kept process-wide
+KNN_GRAPH_K = 10  # neighbours stored per player-season in the exploration graph
+KNN_CHUNK_QUERIES = 512  # player-seasons scored per matrix-matrix product while building it
+QUERY_OPERATORS = {'>': np.greater, '>=': np.greater_equal, '<': np.less, '<=': np.less_equal, '=': np.equal, '!=': np.not_equal}
+QUERY_SAMPLE_ROWS = 2048  # rows sampled to estimate clause selectivity
+QUERY_RANKINGS = ("Column", "Archetype affinity", "Similarity to target")
+MAP_METHODS = {'PCA': 'pca', 'Isomap (non-linear)': 'isomap'}
+MAP_FIT_SAMPLE = 1500  # rows a non-linear map is fitted on; every other row is projected through it
+MAP_NEIGHBOURS = 15
+SQUAD_REGULAR_MINUTES = 900  # season minutes from which a squad player counts as a regular
+TRAJECTORY_LENGTHS = (2, 3)  # consecutive seasons per career-trajectory window
+TRAJECTORY_ALIGNMENTS = {'Season offset': 'season', 'Age': 'age'}
+CROSS_POSITION_GROUP = "All Positions"  # store key of the dataset-wide (cross-position) metric matrices
+CROSS_POSITION_SUFFIXES = {"pct": "_xpos_pct", "z": "_xpos_z"}
+
+# Precomputed per-(position group, metric) distribution tables
+DISTRIBUTION_QUANTILES = np.linspace(0, 100, 101)
+DISTRIBUTION_BINS = 20
+
+# Split-season (multi-team) aggregation
+SPLIT_SEASON_KEYS = ['player_id', 'season_id', 'competition_id']
+SPLIT_SEASON_SUM_COLUMNS = ['minutes', 'appearances', 'starting_appearances', 'subbed_on', 'subbed_off', '90s_played']
+# Ratios whose denominator scales with a per-90 volume are weighted by minutes x volume, not minutes alone.
+SPLIT_SEASON_RATIO_VOLUMES = {'conversion_ratio': 'np_shots_90', 'np_xg_per_shot': 'np_shots_90'}
+TEAM_NAME_SEPARATOR = " / "
+
+# Standardisation cohorts
+NEGATIVE_STATS = ['turnovers_90', 'dispossessions_90', 'dribbled_past_90', 'fouls_90']
+MIN_COHORT_SIZE = 5
+# Inclusive age bands for age-adjusted percentiles; bands with fewer players than
+# MIN_AGE_BAND_SIZE in a position group are pooled with their neighbour.
+AGE_BANDS = [(16, 19), (20, 22), (23, 25), (26, 29), (30, 45)]
+MIN_AGE_BAND_SIZE = 30
+
+# League strength relative to the Championship (1.0). Per-90 metrics are multiplied by the
+# coefficient (negative stats divided) to build the league-adjusted metric space.
+LEAGUE_COEFFICIENTS = {
+    1385: 1.00, 4: 0.85, 51: 0.84, 78: 0.82, 179: 0.80, 5: 0.75, 76: 0.76, 1035: 0.75,
+    1442: 0.73, 129: 0.72, 89: 0.70, 260: 0.70, 1848: 0.68, 65: 0.66, 106: 0.65, 1581: 0.65,
+    1778: 0.64, 107: 0.62, 166: 0.60, 1865: 0.60, 1607: 0.55
+}
+DEFAULT_LEAGUE_COEFFICIENT = 0.70
+LEAGUE_COEFFICIENT_ANCHOR = 1385
+# Refine the table from players who appear in more than one competition (by player_id)
+ESTIMATE_LEAGUE_COEFFICIENTS = True
+LEAGUE_ESTIMATE_MIN_MINUTES = 450
+LEAGUE_ESTIMATE_PRIOR_WEIGHT = 10  # pseudo-observations anchoring each league to its table value
+
+# Alternate metric spaces: column suffixes for the raw, percentile and z-score variants of each metric
+METRIC_SPACES = {
+    "Standard": {"raw": "", "pct": "_pct", "z": "_z"},
+    "Age-Adjusted": {"raw": "", "pct": "_age_pct", "z": "_age_z"},
+    "League-Adjusted": {"raw": "_lg", "pct": "_lg_pct", "z": "_lg_z"},
+}
+
 # --- 4. DATA HANDLING & ANALYSIS FUNCTIONS ---
 
 @st.cache_resource(ttl=3600)
@@ -673,13 +808,9 @@ def get_canonical_season(season_str):
     except (ValueError, TypeError):
         return 0
 
-@st.cache_data(ttl=3600)
-def process_data(_raw_data):
-    """Processes raw data to calculate ages, position groups, and normalized metrics"""
-    if _raw_data is None:
-        return None
-
-    df_processed = _raw_data.copy()
+def _prepare_player_rows(raw_data):
+    """Renames API columns and derives ages, position groups and combined metrics for every raw row."""
+    df_processed = raw_data.copy()
     df_processed.columns = [c.replace('player_season_', '') for c in df_processed.columns]
     
     for col in ['player_name', 'team_name', 'league_name', 'season_name', 'primary_position']:
@@ -706,44 +837,350 @@ def process_data(_raw_data):
         df_processed['padj_tackles_and_interceptions_90'] = (
             df_processed['padj_tackles_90'] + df_processed['padj_interceptions_90']
         )
+    return df_processed
+
+def _is_rate_column(col):
+    return col in ALL_METRICS_TO_PERCENTILE or '_90' in col or '_ratio' in col or 'length' in col or col == 'league_coefficient'
+
+def _minutes_weighted_aggregate(df, keys, weights, count_col='team_count'):
+    """
+    Collapses all rows sharing `keys` into one row in a single grouped pass.
+    Rate metrics (per-90s, ratios, lengths) are averaged with `weights`, ignoring missing values;
+    counting columns in SPLIT_SEASON_SUM_COLUMNS are summed; every other column is taken from
+    the row with the largest weight. Team names are joined in weight order and the number of
+    rows merged into each group is stored in `count_col`.
+    """
+    df = df.assign(_weight=np.asarray(weights, dtype=float)).sort_values('_weight', ascending=False, kind='stable')
+    group_ids = df.groupby(keys, sort=False, dropna=False).ngroup().to_numpy()
+
+    numeric_cols = [c for c in df.select_dtypes('number').columns if c not in keys and c != '_weight']
+    sum_cols = [c for c in SPLIT_SEASON_SUM_COLUMNS if c in numeric_cols]
+    rate_cols = [c for c in numeric_cols if c not in sum_cols and _is_rate_column(c)]
+    other_cols = [c for c in df.columns if c not in sum_cols and c not in rate_cols and c not in ('_weight', count_col)]
+
+    values = df[rate_cols].to_numpy(dtype=float)
+    valid = ~np.isnan(values)
+    row_weights = np.repeat(np.nan_to_num(df['_weight'].to_numpy())[:, None], len(rate_cols), axis=1)
+    for col, volume_col in SPLIT_SEASON_RATIO_VOLUMES.items():
+        if col in rate_cols and volume_col in df.columns:
+            row_weights[:, rate_cols.index(col)] *= df[volume_col].fillna(0).to_numpy()
+    row_weights = np.where(valid, row_weights, 0.0)
+
+    weighted_sum = pd.DataFrame(np.where(valid, values * row_weights, 0.0), columns=rate_cols).groupby(group_ids).sum()
+    weight_total = pd.DataFrame(row_weights, columns=rate_cols).groupby(group_ids).sum()
+    plain_mean = pd.DataFrame(values, columns=rate_cols).groupby(group_ids).mean()
+    rates = (weighted_sum / weight_total.where(weight_total > 0)).fillna(plain_mean)
+
+    grouped = df.reset_index(drop=True).groupby(group_ids)
+    merged = pd.concat([grouped[other_cols].first(), grouped[sum_cols].sum(min_count=1), rates], axis=1)
+    if 'team_name' in df.columns:
+        merged['team_name'] = grouped['team_name'].agg(lambda names: TEAM_NAME_SEPARATOR.join(dict.fromkeys(names.dropna())))
+    merged[count_col] = grouped.size()
+    return merged[[c for c in df.columns if c not in ('_weight', count_col)] + [count_col]].reset_index(drop=True)
+
+def aggregate_split_seasons(df):
+    """
+    Merges the per-team rows of players who moved mid-season into one minutes-weighted
+    profile per (player_id, season_id, competition_id).
+    Returns the merged frame and the original per-team rows that were merged.
+    """
+    if any(k not in df.columns for k in SPLIT_SEASON_KEYS) or 'minutes' not in df.columns:
+        return df.assign(team_count=1), df.iloc[0:0]
+
+    is_split = df.duplicated(SPLIT_SEASON_KEYS, keep=False)
+    if not is_split.any():
+        return df.assign(team_count=1), df.iloc[0:0]
+
+    split_rows = df[is_split]
+    merged = _minutes_weighted_aggregate(split_rows, SPLIT_SEASON_KEYS, split_rows['minutes'].fillna(0))
+    combined = pd.concat([df[~is_split].assign(team_count=1), merged], ignore_index=True)
+    return combined, split_rows.sort_values(SPLIT_SEASON_KEYS + ['minutes'], ascending=[True, True, True, False])
+
+@st.cache_data(ttl=3600)
+def get_split_season_rows(_raw_data):
+    """Per-team rows of every split player-season, kept for on-demand breakdowns."""
+    if _raw_data is None:
+        return None
+    _, split_rows = aggregate_split_seasons(_prepare_player_rows(_raw_data))
+    return split_rows
+
+def get_team_split_breakdown(split_rows, player):
+    """Returns the per-team rows that make up a merged player-season (empty if the player did not move)."""
+    if split_rows is None or split_rows.empty or player.get('team_count', 1) <= 1:
+        return pd.DataFrame()
+    mask = np.ones(len(split_rows), dtype=bool)
+    for key in SPLIT_SEASON_KEYS:
+        mask &= (split_rows[key] == player[key]).to_numpy()
+    return split_rows[mask]
+
+def teams_in_selection(df):
+    """Sorted unique team names, splitting merged multi-team rows into their individual clubs."""
+    return sorted(set(df['team_name'].dropna().str.split(TEAM_NAME_SEPARATOR, regex=False).explode()))
+
+def filter_by_team(df, team_name):
+    """Rows that played for `team_name`, including merged rows of players who moved mid-season."""
+    return df[df['team_name'].str.split(TEAM_NAME_SEPARATOR, regex=False).apply(lambda teams: isinstance(teams, list) and team_name in teams)]
+
+def season_ages(df):
+    """
+    Each row's age during its season: the age on 1 January of the canonical (end) season year,
+    from birth_date, so historical seasons are aged as they were played and never drift with
+    today's date. Unknown birth dates or seasons give NaN.
+    """
+    season = df['canonical_season'].where(df['canonical_season'] > 0).to_numpy(dtype=float)
+    birth = pd.to_datetime(df['birth_date'], errors='coerce') if 'birth_date' in df.columns else pd.Series(pd.NaT, index=df.index)
+    before_birthday = ((birth.dt.month > 1) | (birth.dt.day > 1)).to_numpy(dtype=float)
+    return pd.Series(season - birth.dt.year.to_numpy(dtype=float) - before_birthday, index=df.index)
+
+def assign_age_bands(df):
+    """
+    Labels each row with the AGE_BANDS band of its season age, pooling bands that are too sparse
+    within a position group with the neighbouring band. Rows with unknown age get no band.
+    """
+    edges = [lo for lo, _ in AGE_BANDS] + [AGE_BANDS[-1][1] + 1]
+    band_idx = pd.cut(df['season_age'], bins=edges, right=False, labels=False)
+    counts = pd.crosstab(df['position_group'], band_idx).reindex(columns=range(len(AGE_BANDS)), fill_value=0)
+
+    labels = pd.Series(index=df.index, dtype=object)
+    for group, band_counts in counts.iterrows():
+        # Greedily merge consecutive bands until each pooled band is large enough
+        pooled, current, total = [], [], 0
+        for band, count in band_counts.items():
+            current.append(band)
+            total += count
+            if total >= MIN_AGE_BAND_SIZE:
+                pooled.append(current)
+                current, total = [], 0
+        if current:
+            if pooled:
+                pooled[-1].extend(current)
+            else:
+                pooled.append(current)
+        for bands in pooled:
+            label = f"{AGE_BANDS[bands[0]][0]}-{AGE_BANDS[bands[-1]][1]}"
+            labels[(df['position_group'] == group) & band_idx.isin(bands)] = label
+    return labels
+
+def _standardise_metrics(df, metrics, cohort_keys, suffixes):
+    """
+    Percentile ranks and z-scores of `metrics` within each cohort, computed in one grouped pass.
+    Negative stats are inverted for percentiles; cohorts smaller than MIN_COHORT_SIZE are left empty.
+    """
+    values = df[[f"{m}{suffixes['raw']}" for m in metrics]].astype(float)
+    values.columns = metrics
+    cohorts = values.groupby([df[k] for k in cohort_keys], dropna=True)
+    cohort_size = df.groupby(cohort_keys, dropna=True)[cohort_keys[0]].transform('size')
+    too_small = (cohort_size < MIN_COHORT_SIZE) | cohort_size.isna()
+
+    pct = cohorts.rank(pct=True) * 100
+    negative = [m for m in metrics if m in NEGATIVE_STATS]
+    pct[negative] = 100 - pct[negative]
+
+    mean = cohorts.transform('mean')
+    std = (values - mean).pow(2).groupby([df[k] for k in cohort_keys], dropna=True).transform('mean').pow(0.5)
+    z = (values - mean) / std.where(std > 0, 1.0)
+
+    pct[too_small.to_numpy()] = np.nan
+    z[too_small.to_numpy()] = np.nan
+    pct.columns = [f"{m}{suffixes['pct']}" for m in metrics]
+    z.columns = [f"{m}{suffixes['z']}" for m in metrics]
+    return pd.concat([pct, z], axis=1)
+
+def estimate_league_coefficients(df):
+    """
+    Estimates league strength from players who appear in two competitions within a season of
+    each other. For each such pair, the median log-ratio of their per-90 output is one observation
+    of log(c_a) - log(c_b); the coefficients are the least-squares fit of all observations with
+    LEAGUE_COEFFICIENTS as a prior, rescaled so the anchor league keeps its table value.
+    Returns a Series indexed by competition_id.
+    """
+    leagues = sorted(df['competition_id'].dropna().unique())
+    prior = pd.Series({lid: LEAGUE_COEFFICIENTS.get(lid, DEFAULT_LEAGUE_COEFFICIENT) for lid in leagues})
+    per90 = [m for m in ALL_METRICS_TO_PERCENTILE if '_90' in m and m in df.columns and m not in NEGATIVE_STATS]
+    season = df['season_name'].apply(get_canonical_season) if 'season_name' in df.columns else pd.Series(0, index=df.index)
+
+    rows = df.loc[df['minutes'] >= LEAGUE_ESTIMATE_MIN_MINUTES, ['player_id', 'competition_id'] + per90].assign(_season=season)
+    pairs = rows.merge(rows, on='player_id', suffixes=('_a', '_b'))
+    pairs = pairs[(pairs['competition_id_a'] < pairs['competition_id_b']) & ((pairs['_season_a'] - pairs['_season_b']).abs() <= 1)]
+    if pairs.empty:
+        return prior
+
+    a = pairs[[f'{m}_a' for m in per90]].to_numpy(dtype=float)
+    b = pairs[[f'{m}_b' for m in per90]].to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_ratio = np.where((a > 0) & (b > 0), np.log(b / a), np.nan)
+    observed = np.nanmedian(log_ratio, axis=1)
+    keep = ~np.isnan(observed)
+    if not keep.any():
+        return prior
+
+    position = {lid: i for i, lid in enumerate(leagues)}
+    n_obs = int(keep.sum())
+    design = np.zeros((n_obs + len(leagues), len(leagues)))
+    design[np.arange(n_obs), pairs['competition_id_a'][keep].map(position).to_numpy()] = 1.0
+    design[np.arange(n_obs), pairs['competition_id_b'][keep].map(position).to_numpy()] = -1.0
+    prior_weight = np.sqrt(LEAGUE_ESTIMATE_PRIOR_WEIGHT)
+    design[n_obs:] = np.eye(len(leagues)) * prior_weight
+    target = np.concatenate([observed[keep], np.log(prior.to_numpy()) * prior_weight])
+    log_coef, *_ = np.linalg.lstsq(design, target, rcond=None)
+    coefficients = pd.Series(np.exp(log_coef), index=leagues)
+    if LEAGUE_COEFFICIENT_ANCHOR in coefficients.index:
+        coefficients /= coefficients[LEAGUE_COEFFICIENT_ANCHOR] / LEAGUE_COEFFICIENTS.get(LEAGUE_COEFFICIENT_ANCHOR, 1.0)
+    return coefficients
+
+def league_adjust_metrics(df, metrics):
+    """League-adjusted copies of `metrics`: per-90s scaled by the league coefficient, everything else unchanged."""
+    suffix = METRIC_SPACES['League-Adjusted']['raw']
+    coefficient = df['league_coefficient'].to_numpy()
+    adjusted = {}
+    for metric in metrics:
+        values = df[metric].to_numpy(dtype=float)
+        if '_90' in metric:
+            values = values / coefficient if metric in NEGATIVE_STATS else values * coefficient
+        adjusted[f'{metric}{suffix}'] = values
+    return pd.DataFrame(adjusted, index=df.index)
+
+def add_metric_spaces(df, metrics):
+    """
+    Adds season ages, age bands and the percentile/z-score columns of every METRIC_SPACES entry for
+    `metrics`, ranked within the position-group cohorts of `df`. Expects the raw metrics,
+    canonical_season and league_coefficient.
+    """
+    df = df.assign(season_age=season_ages(df))
+    df = df.assign(age_band=assign_age_bands(df))
+    standard = _standardise_metrics(df, metrics, ['position_group'], METRIC_SPACES['Standard'])
+    age_adjusted = _standardise_metrics(df, metrics, ['position_group', 'age_band'], METRIC_SPACES['Age-Adjusted'])
+    # Players without a known age fall back to their position-group cohort
+    age_adjusted = age_adjusted.where(df['age_band'].notna(), standard.to_numpy(), axis=0)
+
+    league_raw = league_adjust_metrics(df, metrics)
+    league_adjusted = _standardise_metrics(pd.concat([df[['position_group']], league_raw], axis=1),
+                                           metrics, ['position_group'], METRIC_SPACES['League-Adjusted'])
+    # Missing percentiles read as 0 on radars; z-scores stay NaN so similarity can mask them out
+    standard, age_adjusted, league_adjusted = [
+        frame.fillna({col: 0 for col in frame.columns if col.endswith('_pct')})
+        for frame in (standard, age_adjusted, league_adjusted)
+    ]
+    return pd.concat([df, standard, age_adjusted, league_raw, league_adjusted], axis=1)
+
+def _metric_space_columns(metrics):
+    """Every column add_metric_spaces derives from `metrics`."""
+    return ['season_age', 'age_band'] + [
+        f"{m}{suffix}" for m in metrics for suffixes in METRIC_SPACES.values()
+        for suffix in suffixes.values() if suffix
+    ]
+
+@st.cache_data(ttl=3600)
+def process_data(_raw_data):
+    """Processes raw data to calculate ages, position groups, and normalized metrics"""
+    if _raw_data is None:
+        return None
+
+    df_processed = _prepare_player_rows(_raw_data)
+    df_processed, _ = aggregate_split_seasons(df_processed)
     
-    negative_stats = ['turnovers_90', 'dispossessions_90', 'dribbled_past_90', 'fouls_90']
-    
+    available_metrics = [m for m in ALL_METRICS_TO_PERCENTILE if m in df_processed.columns]
     for metric in ALL_METRICS_TO_PERCENTILE:
         if metric not in df_processed.columns:
             df_processed[metric] = 0
-            continue
-            
-        df_processed[f'{metric}_pct'] = 0
-        df_processed[f'{metric}_z'] = 0.0
-        
-        for group, group_df in df_processed.groupby('position_group', dropna=False):
-            if group is None or len(group_df) < 5:
-                continue
-                
-            metric_series = group_df[metric]
-            
-            if metric in negative_stats:
-                ranks = metric_series.rank(pct=True, ascending=True)
-                df_processed.loc[group_df.index, f'{metric}_pct'] = (1 - ranks) * 100
-            else:
-                df_processed.loc[group_df.index, f'{metric}_pct'] = metric_series.rank(pct=True) * 100
-            
-            scaler = StandardScaler()
-            z_scores = scaler.fit_transform(metric_series.values.reshape(-1, 1)).flatten()
-            df_processed.loc[group_df.index, f'{metric}_z'] = z_scores
-
-    metric_cols = [col for col in df_processed.columns if '_90' in col or '_ratio' in col or 'length' in col]
-    pct_cols = [col for col in df_processed.columns if '_pct' in col]
-    z_cols = [col for col in df_processed.columns if '_z' in col]
-    cols_to_clean = list(set(metric_cols + pct_cols + z_cols))
-    df_processed[cols_to_clean] = df_processed[cols_to_clean].fillna(0)
-    
-    if 'season_name' in df_processed.columns:
-        df_processed['canonical_season'] = df_processed['season_name'].apply(get_canonical_season)
 
+    league_coefficients = estimate_league_coefficients(df_processed) if ESTIMATE_LEAGUE_COEFFICIENTS else pd.Series(LEAGUE_COEFFICIENTS)
+    df_processed['league_coefficient'] = df_processed['competition_id'].map(league_coefficients).fillna(DEFAULT_LEAGUE_COEFFICIENT)
+    df_processed['canonical_season'] = df_processed['season_name'].apply(get_canonical_season) if 'season_name' in df_processed.columns else 0
+    df_processed = add_metric_spaces(df_processed, available_metrics)
+
+    z_suffixes = tuple(suffixes['z'] for suffixes in METRIC_SPACES.values())
+    metric_cols = [col for col in df_processed.columns
+                   if ('_90' in col or '_ratio' in col or 'length' in col) and not col.endswith(z_suffixes)]
+    df_processed[metric_cols] = df_processed[metric_cols].fillna(0)
+
+    # Consolidate the many single-column blocks so row gathers on the result stay cheap
+    df_processed = df_processed.copy()
+    # Fingerprinted once here, so reruns read the version instead of rehashing every row
+    df_processed.attrs['dataset_version'] = get_dataset_version(df_processed)
     return df_processed
 
+def get_dataset_version(df):
+    """Cheap fingerprint of a processed dataset, used to key every index and table derived from it."""
+    key_cols = [c for c in ['player_id', 'season_id', 'competition_id', 'minutes'] if c in df.columns]
+    fingerprint = int(pd.util.hash_pandas_object(df[key_cols], index=False).sum())
+    return f"{len(df)}-{fingerprint:016x}"
+
+@st.cache_resource(ttl=3600)
+def get_distribution_tables(_processed_data, dataset_version):
+    """
+    Compact ECDF and fixed-bin histogram tables for every (position_group, metric) pair, so
+    distribution views never scan processed_data. ECDFs store the raw value at each whole
+    percentile; histograms use DISTRIBUTION_BINS bins between the 1st and 99th percentiles.
+    """
+    tables = {}
+    metrics = [m for m in ALL_METRICS_TO_PERCENTILE if m in _processed_data.columns]
+    for group, group_df in _processed_data.groupby('position_group'):
+        values = group_df[metrics].to_numpy(dtype=float)
+        quantiles = np.nanquantile(values, DISTRIBUTION_QUANTILES / 100, axis=0)
+        for j, metric in enumerate(metrics):
+            column = values[:, j]
+            column = column[~np.isnan(column)]
+            if len(column) < MIN_COHORT_SIZE:
+                continue
+            lo, hi = quantiles[1, j], quantiles[99, j]
+            if hi <= lo:
+                lo, hi = column.min(), column.max() + 1e-9
+            counts, edges = np.histogram(np.clip(column, lo, hi), bins=DISTRIBUTION_BINS, range=(lo, hi))
+            tables[(group, metric)] = {
+                'quantiles': quantiles[:, j].astype(np.float32),
+                'counts': counts.astype(np.int32),
+                'edges': edges.astype(np.float32),
+                'n': len(column),
+                'negative': metric in NEGATIVE_STATS,
+            }
+    return tables
+
+def percentile_to_value(table, percentile):
+    """Raw value at a (display) percentile, reading only the ECDF table."""
+    if table['negative']:
+        percentile = 100 - percentile
+    return float(np.interp(percentile, DISTRIBUTION_QUANTILES, table['quantiles']))
+
+def value_to_percentile(table, value):
+    """Display percentile of a raw value, reading only the ECDF table."""
+    percentile = float(np.interp(value, table['quantiles'], DISTRIBUTION_QUANTILES))
+    return 100 - percentile if table['negative'] else percentile
+
+def seasons_in_scope(canonical_seasons, search_scope):
+    """The canonical seasons covered by a search scope, most recent first."""
+    canonical_seasons = sorted(pd.unique(canonical_seasons), reverse=True)
+    n_seasons = SEARCH_SCOPES.get(search_scope)
+    return canonical_seasons[:n_seasons] if n_seasons else canonical_seasons
+
+@st.cache_resource(ttl=3600)
+def get_blended_profiles(_processed_data, dataset_version, search_scope, recency_half_life=0.0):
+    """
+    One minutes-weighted profile per (player_id, position_group) across the seasons in scope,
+    optionally decayed so a season `recency_half_life` seasons old counts half as much.
+    Percentiles and z-scores are recomputed within the blended cohort, so blended rows can be
+    searched exactly like player-seasons.
+    """
+    seasons = seasons_in_scope(_processed_data['canonical_season'], search_scope)
+    metrics = [m for m in ALL_METRICS_TO_PERCENTILE if f"{m}{METRIC_SPACES['Standard']['pct']}" in _processed_data.columns]
+    rows = _processed_data[_processed_data['canonical_season'].isin(seasons) & _processed_data['position_group'].notna()]
+    rows = rows.drop(columns=[c for c in _metric_space_columns(metrics) if c in rows.columns])
+
+    weights = rows['minutes'].fillna(0).to_numpy(dtype=float)
+    if recency_half_life:
+        weights = weights * 0.5 ** ((max(seasons) - rows['canonical_season'].to_numpy()) / recency_half_life)
+
+    season_range = rows.groupby(['player_id', 'position_group'])['canonical_season'].agg(['min', 'max'])
+    blended = _minutes_weighted_aggregate(rows, ['player_id', 'position_group'], weights, count_col='seasons_blended')
+    span = season_range.reindex(pd.MultiIndex.from_frame(blended[['player_id', 'position_group']]))
+    blended['season_name'] = [f"Blend {lo}" if lo == hi else f"Blend {lo}-{hi}" for lo, hi in zip(span['min'], span['max'])]
+    blended['canonical_season'] = span['max'].to_numpy()
+    blended['season_id'] = BLENDED_SEASON_ID
+    return add_metric_spaces(blended, metrics).copy()
+
+def get_blended_version(dataset_version, search_scope, recency_half_life):
+    return f"{dataset_version}:blend:{search_scope}:{recency_half_life}"
+
 # --- 5. ANALYSIS & REPORTING FUNCTIONS ---
 
 def find_player_by_name(df, player_name):
@@ -757,10 +1194,11 @@ def find_player_by_name(df, player_name):
         return None, suggestions
     return None, None
 
-def detect_player_archetype(target_player, archetypes):
+def detect_player_archetype(target_player, archetypes, metric_space="Standard"):
+    pct_suffix = METRIC_SPACES[metric_space]['pct']
     archetype_scores = {}
     for name, config in archetypes.items():
-        metrics = [f"{m}_pct" for m in config['identity_metrics']]
+        metrics = [f"{m}{pct_suffix}" for m in config['identity_metrics']]
         valid_metrics = [m for m in metrics if m in target_player.index and pd.notna(target_player[m])]
         score = target_player[valid_metrics].mean() if valid_metrics else 0
         archetype_scores[name] = score
@@ -768,85 +1206,1355 @@ def detect_player_archetype(target_player, archetypes):
     best_archetype = max(archetype_scores, key=archetype_scores.get) if archetype_scores else None
     return best_archetype, pd.DataFrame(archetype_scores.items(), columns=['Archetype', 'Affinity Score']).sort_values(by='Affinity Score', ascending=False)
 
-def find_matches(target_player, pool_df, archetype_config, search_mode='similar', min_minutes=600):
-    """Finds similar players using z-scores and cosine similarity"""
-    key_identity_metrics = archetype_config['identity_metrics']
-    key_weight = archetype_config['key_weight']
-    
-    z_metrics = [f'{m}_z' for m in key_identity_metrics]
-    target_group = target_player['position_group']
-    
-    pool_df = pool_df[
-        (pool_df['minutes'] >= min_minutes) & 
-        (pool_df['player_id'] != target_player['player_id']) & 
-        (pool_df['position_group'] == target_group)
-    ].copy()
-    
-    if pool_df.empty:
+@st.cache_resource
+def get_result_cache():
+    """Process-wide LRU of per-target score vectors and archetype detections, shared by all sessions."""
+    return {'entries': OrderedDict(), 'hits': 0, 'misses': 0, 'dataset_version': None, 'lock': threading.Lock()}
+
+def cached_result(key, dataset_version, compute):
+    """
+    Returns the cached value for `key`, or stores and returns compute(). The whole cache is
+    dropped when `dataset_version` changes, and the least recently used entries are evicted
+    beyond RESULT_CACHE_SIZE.
+    """
+    cache = get_result_cache()
+    with cache['lock']:
+        if cache['dataset_version'] != dataset_version:
+            cache['entries'].clear()
+            cache['dataset_version'] = dataset_version
+        if key in cache['entries']:
+            cache['entries'].move_to_end(key)
+            cache['hits'] += 1
+            return cache['entries'][key]
+        cache['misses'] += 1
+    value = compute()
+    with cache['lock']:
+        cache['entries'][key] = value
+        while len(cache['entries']) > RESULT_CACHE_SIZE:
+            cache['entries'].popitem(last=False)
+    return value
+
+def _build_group_store(df, rows, metric_space="Standard", suffixes=None):
+    """
+    Contiguous z-score and percentile matrices plus filter side arrays for the rows at positions
+    `rows` of `df`. Missing z-scores are stored as 0 with a validity bitmap alongside; the
+    pairwise-complete z-score covariance is kept for Mahalanobis whitening. `suffixes` overrides
+    the metric space's column suffixes.
+    """
+    suffixes = suffixes or METRIC_SPACES[metric_space]
+    group_df = df.iloc[rows]
+    metrics = [m for m in ALL_METRICS_TO_PERCENTILE if f"{m}{suffixes['z']}" in df.columns]
+
+    def side_array(col, dtype):
+        return group_df[col].to_numpy(dtype=dtype) if col in group_df.columns else np.full(len(group_df), np.nan, dtype=dtype)
+
+    z_frame = group_df[[f"{m}{suffixes['z']}" for m in metrics]]
+    z = z_frame.to_numpy(dtype=np.float32)
+    z_cov = z_frame.cov().to_numpy()
+    return {
+        'rows': np.asarray(rows, dtype=np.int64),
+        'suffixes': suffixes,
+        'metrics': metrics,
+        'metric_index': {m: i for i, m in enumerate(metrics)},
+        'z': np.ascontiguousarray(np.nan_to_num(z)),
+        'valid': np.ascontiguousarray(~np.isnan(z), dtype=np.float32),
+        'z_cov': np.where(np.isnan(z_cov), np.eye(len(metrics)), z_cov),
+        'pct': np.ascontiguousarray(np.nan_to_num(group_df[[f"{m}{suffixes['pct']}" for m in metrics]].to_numpy(dtype=np.float32))),
+        'player_id': group_df['player_id'].to_numpy(),
+        'position_group': side_array('position_group', object),
+        'season_id': side_array('season_id', np.float64),
+        'competition_id': side_array('competition_id', np.float64),
+        'canonical_season': side_array('canonical_season', np.float64),
+        'minutes': side_array('minutes', np.float32),
+        'age': side_array('age', np.float32),
+        'season_age': side_array('season_age', np.float32),
+    }
+
+@st.cache_resource(ttl=3600)
+def get_metric_store(_df, dataset_version, metric_space="Standard"):
+    """Per-position-group metric matrices of `_df`, built once per dataset version and metric space."""
+    groups = _df.groupby('position_group').indices
+    return {group: _build_group_store(_df, rows, metric_space) for group, rows in groups.items()}
+
+@st.cache_resource(ttl=3600)
+def get_cross_position_store(_df, dataset_version, metric_space="Standard"):
+    """
+    One metric store over every row of `_df`, standardised against the whole dataset instead of
+    the position-group cohorts (on the metric space's raw values), so players of different
+    groups share a scale. Keeps each metric's mean, std and sorted values to place targets.
+    """
+    raw_suffix = METRIC_SPACES[metric_space]['raw']
+    metrics = [m for m in ALL_METRICS_TO_PERCENTILE if f"{m}{raw_suffix}" in _df.columns]
+    suffixes = {'raw': raw_suffix, **CROSS_POSITION_SUFFIXES}
+    side_columns = [c for c in ('player_id', 'position_group', 'season_id', 'competition_id', 'canonical_season', 'minutes', 'age') if c in _df.columns]
+    frame = _df[side_columns + [f"{m}{raw_suffix}" for m in metrics]].assign(cohort=0)
+    scores = _standardise_metrics(frame, metrics, ['cohort'], suffixes)
+    scores = scores.fillna({col: 0 for col in scores.columns if col.endswith('_pct')})
+    store = _build_group_store(pd.concat([frame, scores], axis=1), np.arange(len(frame)), suffixes=suffixes)
+    raw = frame[[f"{m}{raw_suffix}" for m in metrics]].to_numpy(dtype=np.float64)
+    store['raw_mean'] = np.nanmean(raw, axis=0)
+    store['raw_std'] = np.nanstd(raw, axis=0)
+    store['raw_sorted'] = np.sort(raw, axis=0)
+    store['raw_count'] = (~np.isnan(raw)).sum(axis=0)
+    return store
+
+@st.cache_resource(ttl=3600)
+def get_cross_position_index(_df, dataset_version, metric_space="Standard", distance="Weighted Cosine"):
+    """
+    Like get_similarity_index over the single cross-position store; entries are compiled on first
+    use under (CROSS_POSITION_GROUP, "<home group>: <archetype>").
+    """
+    store = get_cross_position_store(_df, dataset_version, metric_space)
+    return {'store': {CROSS_POSITION_GROUP: store}, 'distance': distance, 'entries': {}}
+
+def cross_position_target(store, target_player):
+    """
+    `target_player` with its cross-position z-scores and percentiles added, placed against the
+    dataset-wide distribution of the store (see get_cross_position_store).
+    """
+    suffixes = store['suffixes']
+    raw = np.array([target_player.get(f"{m}{suffixes['raw']}", np.nan) for m in store['metrics']], dtype=np.float64)
+    z = (raw - store['raw_mean']) / np.where(store['raw_std'] > 0, store['raw_std'], 1.0)
+    # Average rank among the non-missing values, as pandas' rank(pct=True)
+    below = np.array([np.searchsorted(store['raw_sorted'][:n, j], x, 'left') for j, (x, n) in enumerate(zip(raw, store['raw_count']))])
+    at_or_below = np.array([np.searchsorted(store['raw_sorted'][:n, j], x, 'right') for j, (x, n) in enumerate(zip(raw, store['raw_count']))])
+    pct = (below + at_or_below + 1) / 2 / np.maximum(store['raw_count'], 1) * 100
+    pct = np.where([m in NEGATIVE_STATS for m in store['metrics']], 100 - pct, pct)
+    placed = pd.Series(
+        {**{f"{m}{suffixes['z']}": v for m, v in zip(store['metrics'], z)},
+         **{f"{m}{suffixes['pct']}": (0.0 if np.isnan(x) else v) for m, x, v in zip(store['metrics'], raw, pct)}}
+    )
+    return pd.concat([target_player, placed])
+
+def archetype_metric_weights(archetype_config, metrics):
+    """
+    Per-metric similarity weights for the available identity metrics: explicit "metric_weights"
+    from the config, otherwise key_weight on the archetype's key_metrics and 1.0 on the rest.
+    """
+    explicit = archetype_config.get('metric_weights', {})
+    key_metrics = set(archetype_config.get('key_metrics', ()))
+    key_weight = archetype_config.get('key_weight', 1.0)
+    return np.array([explicit.get(m, key_weight if m in key_metrics else 1.0) for m in metrics], dtype=np.float32)
+
+def _similarity_transform(group_store, columns, weights, distance):
+    """
+    Linear map applied to z-score rows (and the target) so that every similarity measure is a
+    dot product in the mapped space: weights for cosine, sqrt(weight)/std for standardised
+    Euclidean, and sqrt(weight)-scaled whitening (inverse square root of the group covariance
+    over the archetype metrics) for Mahalanobis.
+    """
+    if distance == "Weighted Cosine":
+        return np.diag(weights)
+    cov = group_store['z_cov'][np.ix_(columns, columns)]
+    if distance == "Standardised Euclidean":
+        std = np.sqrt(np.maximum(np.diag(cov), 1e-6))
+        return np.diag(np.sqrt(weights) / std)
+    eigenvalues, eigenvectors = np.linalg.eigh(cov)
+    eigenvalues = np.maximum(eigenvalues, 1e-3 * max(eigenvalues.max(), 1e-6))
+    whitening = eigenvectors @ np.diag(eigenvalues ** -0.5) @ eigenvectors.T
+    return whitening @ np.diag(np.sqrt(weights))
+
+def compile_archetype_entry(group_store, archetype_config, distance="Weighted Cosine"):
+    """
+    Compiles an archetype's search matrix for one position group: the identity-metric z-scores
+    mapped once by the similarity measure's transform, with their squares, squared row norms
+    and validity bitmap, so that a masked query is a handful of matrix-vector products.
+    """
+    metrics = [m for m in archetype_config['identity_metrics'] if m in group_store['metric_index']]
+    columns = [group_store['metric_index'][m] for m in metrics]
+    weights = archetype_metric_weights(archetype_config, metrics)
+    transform = _similarity_transform(group_store, columns, weights, distance).astype(np.float32)
+
+    matrix = np.ascontiguousarray(group_store['z'][:, columns] @ transform, dtype=np.float32)
+
+    entry = {k: group_store[k] for k in ('rows', 'suffixes', 'player_id', 'position_group', 'season_id', 'competition_id', 'canonical_season', 'minutes', 'age', 'season_age')}
+    entry.update({
+        'metrics': metrics,
+        'n_requested': len(archetype_config['identity_metrics']),
+        'weights': weights,
+        'distance': distance,
+        'transform': transform,
+        'z': group_store['z'],
+        'columns': np.asarray(columns, dtype=np.int64),
+        'matrix': matrix,
+        'matrix_sq': matrix ** 2,
+        'sq_norms': (matrix ** 2).sum(axis=1),
+        'valid': np.ascontiguousarray(group_store['valid'][:, columns]),
+        'pct': np.ascontiguousarray(group_store['pct'][:, columns]),
+        'min_overlap': int(np.ceil(MIN_METRIC_OVERLAP * len(metrics))),
+        'upgrade_score': (group_store['pct'][:, columns] @ (weights / weights.sum())).astype(np.float32) if weights.sum() > 0 else np.zeros(len(matrix), dtype=np.float32),
+    })
+    return entry
+
+def masked_similarity(entry, target_vector, target_valid, rows=slice(None)):
+    """
+    Similarity in [0, 1] of entry rows (`rows`) to mapped target vector(s), computed only over the
+    metrics present for both players, plus the number of metrics compared. Cosine and standardised
+    Euclidean are restricted exactly to the shared metrics through the validity bitmaps (four
+    matrix-vector products); Mahalanobis mixes metrics, so missing values count as the group mean
+    there. Distances are reported as 1 / (1 + RMS weighted distance). Targets may be stacked as
+    columns of `target_vector` / `target_valid`.
+    """
+    matrix, valid = entry['matrix'][rows], entry['valid'][rows]
+    dot = matrix @ target_vector
+    overlap = valid @ target_valid
+    if entry['distance'] == "Mahalanobis":
+        sq_norms = entry['sq_norms'][rows]
+        dist_sq = (sq_norms[:, None] if dot.ndim == 2 else sq_norms) - 2 * dot + (target_vector ** 2).sum(axis=0)
+        weight_total = entry['weights'].sum()
+    else:
+        candidate_sq = entry['matrix_sq'][rows] @ target_valid
+        target_sq = valid @ target_vector ** 2
+        if entry['distance'] == "Weighted Cosine":
+            denominator = np.sqrt(candidate_sq * target_sq)
+            return np.where(denominator > 0, dot / np.where(denominator > 0, denominator, 1), 0), overlap
+        dist_sq = candidate_sq - 2 * dot + target_sq
+        weight_total = valid @ ((entry['weights'][:, None] if target_valid.ndim == 2 else entry['weights']) * target_valid)
+    return 1 / (1 + np.sqrt(np.maximum(dist_sq, 0) / np.maximum(weight_total, 1e-6))), overlap
+
+@st.cache_resource(ttl=3600)
+def get_similarity_index(_df, dataset_version, metric_space="Standard", distance="Weighted Cosine"):
+    """
+    Precompiled search matrices for every (position_group, archetype) in POSITIONAL_CONFIGS,
+    built once per dataset version and similarity measure. Entries for archetypes of another
+    position's config are compiled on first use by get_archetype_entry.
+    """
+    index = {'store': get_metric_store(_df, dataset_version, metric_space), 'distance': distance, 'entries': {}}
+    for group, config in POSITIONAL_CONFIGS.items():
+        for name, archetype_config in config['archetypes'].items():
+            get_archetype_entry(index, group, name, archetype_config)
+    return index
+
+def get_archetype_entry(index, group, archetype_name, archetype_config):
+    key = (group, archetype_name)
+    if key not in index['entries'] and group in index['store']:
+        index['entries'][key] = compile_archetype_entry(index['store'][group], archetype_config, index['distance'])
+    return index['entries'].get(key)
+
+def custom_profile_config(name, metric_weights):
+    """An archetype-style config for a custom search profile: the chosen metrics with explicit weights."""
+    return {
+        'name': name,
+        'description': "Custom profile over " + ", ".join(metric_label(m) for m in metric_weights) + ".",
+        'identity_metrics': list(metric_weights),
+        'metric_weights': {m: float(w) for m, w in metric_weights.items()},
+    }
+
+@st.cache_data(ttl=3600)
+def load_custom_profiles(path=CUSTOM_PROFILES_PATH):
+    """Saved custom profiles by name; empty when none have been saved yet. Cached until the next save."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+@st.cache_resource
+def get_custom_profiles_lock():
+    """Process-wide lock serialising saves of the custom profiles file across sessions."""
+    return threading.Lock()
+
+def save_custom_profile(config, path=CUSTOM_PROFILES_PATH):
+    """
+    Adds or replaces a profile in the custom profiles file. The file is re-read from disk under a
+    process-wide lock and replaced atomically (temp file + os.replace), so concurrent saves do not
+    drop each other's profiles and a failed write leaves the previous file intact.
+    """
+    with get_custom_profiles_lock():
+        load_custom_profiles.clear()
+        profiles = load_custom_profiles(path)
+        profiles[config['name']] = config
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(profiles, f, indent=2)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        load_custom_profiles.clear()
+
+def archetype_membership_matrix(group_store, archetypes):
+    """
+    Metrics x archetypes matrix whose column for an archetype averages its identity metrics that
+    exist in the store, so that percentiles @ membership gives every row's archetype affinity.
+    """
+    membership = np.zeros((len(group_store['metrics']), len(archetypes)), dtype=np.float32)
+    for j, config in enumerate(archetypes.values()):
+        columns = [group_store['metric_index'][m] for m in config['identity_metrics'] if m in group_store['metric_index']]
+        if columns:
+            membership[columns, j] = 1.0 / len(columns)
+    return membership
+
+@st.cache_resource(ttl=3600)
+def get_archetype_affinity(_df, dataset_version, metric_space="Standard"):
+    """
+    Players x archetypes affinity matrix of every position group against its own archetypes,
+    one matrix product per group, built once per dataset version and metric space.
+    """
+    affinity = {}
+    for group, group_store in get_metric_store(_df, dataset_version, metric_space).items():
+        if group not in POSITIONAL_CONFIGS:
+            continue
+        archetypes = POSITIONAL_CONFIGS[group]['archetypes']
+        affinity[group] = {
+            'archetypes': list(archetypes),
+            'scores': group_store['pct'] @ archetype_membership_matrix(group_store, archetypes),
+            'store': group_store,
+        }
+    return affinity
+
+def _store_rows(group_store, df, targets):
+    """Rows of a group store (and its affinity matrix) for target rows of `df` (by index label); -1 where absent."""
+    rows = group_store['rows']
+    positions = df.index.get_indexer(targets)
+    found = np.minimum(np.searchsorted(rows, positions), len(rows) - 1)
+    return np.where((positions >= 0) & (rows[found] == positions), found, -1)
+
+def lookup_player_archetype(affinity, df, target_player, archetypes, metric_space="Standard"):
+    """
+    detect_player_archetype as a row lookup in the precomputed affinity matrix when the target
+    is a row of `df` scored against its own group's archetypes; computed directly otherwise.
+    """
+    group_affinity = affinity.get(target_player['position_group'])
+    if group_affinity is not None and list(archetypes) == group_affinity['archetypes']:
+        row = _store_rows(group_affinity['store'], df, [target_player.name])[0]
+        if row >= 0:
+            scores = group_affinity['scores'][row].astype(float)
+            dna_df = pd.DataFrame({'Archetype': group_affinity['archetypes'], 'Affinity Score': scores})
+            return group_affinity['archetypes'][int(np.argmax(scores))], dna_df.sort_values(by='Affinity Score', ascending=False)
+    return detect_player_archetype(target_player, archetypes, metric_space)
+
+def archetype_leaderboard(df, affinity, group, archetype, top_k=20, min_minutes=0, seasons=None, competition_ids=None, age_range=None):
+    """The top_k rows of `df` by affinity to one archetype of their group, after the usual pool filters."""
+    group_affinity = affinity.get(group)
+    if group_affinity is None or archetype not in group_affinity['archetypes']:
+        return pd.DataFrame()
+    scores = group_affinity['scores'][:, group_affinity['archetypes'].index(archetype)]
+    candidates = np.flatnonzero(build_pool_mask(group_affinity['store'], None, min_minutes, seasons, competition_ids, age_range))
+    pool_size = len(candidates)
+    if top_k < len(candidates):
+        candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+    candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+    leaderboard = df.iloc[group_affinity['store']['rows'][candidates]]
+    leaderboard.insert(0, 'affinity_score', scores[candidates])
+    leaderboard.insert(0, 'rank', np.arange(1, len(candidates) + 1))
+    leaderboard.attrs['pool_size'] = pool_size
+    return leaderboard
+
+def build_ann_index(entry, seed=0):
+    """
+    IVF (inverted file) index over an entry's search matrix. Rows are clustered with k-means into
+    ~sqrt(n) lists and stored list by list, so a query only scores the rows of the lists whose
+    centroids are closest to the target.
+    """
+    matrix = entry['matrix']
+    if entry['distance'] == "Weighted Cosine":
+        matrix = matrix / np.maximum(np.sqrt(entry['sq_norms'])[:, None], 1e-12)
+    n_lists = max(1, int(np.sqrt(len(matrix))))
+    kmeans = KMeans(n_clusters=n_lists, n_init=1, max_iter=25, random_state=seed).fit(matrix)
+    centroids = kmeans.cluster_centers_.astype(np.float32)
+    if entry['distance'] == "Weighted Cosine":
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        centroid_sq = np.zeros(n_lists, dtype=np.float32)
+    else:
+        centroid_sq = (centroids ** 2).sum(axis=1)
+    order = np.argsort(kmeans.labels_, kind='stable')
+    return {
+        'centroids': np.ascontiguousarray(centroids),
+        'centroid_sq': centroid_sq,
+        'order': order,
+        'offsets': np.searchsorted(kmeans.labels_[order], np.arange(n_lists + 1)),
+        'n_probe': max(1, int(np.ceil(n_lists * ANN_PROBE_FRACTION))),
+    }
+
+def ann_candidates(ann, target_vector, pool_mask, k):
+    """
+    Entry rows to score for an approximate query: the pool rows of the n_probe lists nearest the
+    target. Further lists are probed until at least k pool rows are found, so heavily filtered
+    queries still return a full page.
+    """
+    order, offsets = ann['order'], ann['offsets']
+    in_pool = np.concatenate([[0], np.cumsum(pool_mask[order])])
+    list_rank = np.argsort(ann['centroid_sq'] - 2 * (ann['centroids'] @ target_vector))
+    found = np.cumsum(in_pool[offsets[list_rank + 1]] - in_pool[offsets[list_rank]])
+    n_lists = max(ann['n_probe'], int(np.searchsorted(found, k)) + 1)
+    rows = np.concatenate([order[offsets[l]:offsets[l + 1]] for l in list_rank[:n_lists]])
+    return np.sort(rows[pool_mask[rows]])
+
+@st.cache_resource(ttl=3600)
+def get_ann_indexes(_df, dataset_version, metric_space="Standard", distance="Weighted Cosine"):
+    """IVF indexes for every precompiled (position_group, archetype) entry with at least ANN_MIN_POOL rows, built once per dataset version."""
+    index = get_similarity_index(_df, dataset_version, metric_space, distance)
+    return {key: build_ann_index(entry) for key, entry in index['entries'].items()
+            if len(entry['rows']) >= ANN_MIN_POOL and entry['metrics']}
+
+@st.cache_data(ttl=3600)
+def get_ann_recall_report(_df, dataset_version, metric_space="Standard", distance="Weighted Cosine", k=10, n_queries=ANN_RECALL_QUERIES, seed=0):
+    """
+    Recall@k of each ANN index against exact search, using a sample of the entry's own rows as
+    targets over the unfiltered pool. Also reports the mean share of rows scored per query.
+    """
+    index = get_similarity_index(_df, dataset_version, metric_space, distance)
+    rng = np.random.default_rng(seed)
+    report = []
+    for (group, archetype), ann in get_ann_indexes(_df, dataset_version, metric_space, distance).items():
+        entry = index['entries'][(group, archetype)]
+        queries = rng.choice(len(entry['rows']), min(n_queries, len(entry['rows'])), replace=False)
+        hits, scanned = 0, 0
+        for q in queries:
+            target_vector, target_valid = entry['matrix'][q], entry['valid'][q]
+            pool_mask = entry['player_id'] != entry['player_id'][q]
+            exact = np.flatnonzero(pool_mask)
+            exact = exact[np.argpartition(-masked_similarity(entry, target_vector, target_valid)[0][exact], k - 1)[:k]]
+            candidates = ann_candidates(ann, target_vector, pool_mask, k)
+            approx = candidates[np.argpartition(-masked_similarity(entry, target_vector, target_valid, candidates)[0], k - 1)[:k]]
+            hits += len(np.intersect1d(exact, approx))
+            scanned += len(candidates)
+        report.append({
+            'Position Group': group, 'Archetype': archetype, 'Rows': len(entry['rows']),
+            'Lists': len(ann['centroids']), f'Recall@{k}': hits / (k * len(queries)),
+            'Rows Scored %': 100 * scanned / (len(queries) * len(entry['rows'])),
+        })
+    return pd.DataFrame(report)
+
+def build_knn_graph(similarity_index, affinity, k=KNN_GRAPH_K, chunk_queries=KNN_CHUNK_QUERIES):
+    """
+    Top-k neighbour lists of every player-season of each position group, scored with the entry of
+    its detected archetype (argmax of the affinity matrix) over the whole group, other seasons of
+    the same player and rows below the entry's min_overlap excluded. Per group: `neighbours`
+    (int32 store rows, -1 padded) and `scores` (float16, x 100) of shape rows x k, plus a CSR
+    reverse index (`reverse_offsets`, `reverse_sources`) of who lists each row.
+    """
+    graph = {}
+    for group, group_affinity in affinity.items():
+        archetype_of_row = np.argmax(group_affinity['scores'], axis=1)
+        n = len(group_affinity['store']['rows'])
+        neighbours = np.full((n, k), -1, dtype=np.int32)
+        scores = np.zeros((n, k), dtype=np.float16)
+        for a, name in enumerate(group_affinity['archetypes']):
+            entry = get_archetype_entry(similarity_index, group, name, POSITIONAL_CONFIGS[group]['archetypes'][name])
+            if entry is None or not entry['metrics']:
+                continue
+            queries = np.flatnonzero(archetype_of_row == a)
+            kk = min(k, n)
+            for start in range(0, len(queries), chunk_queries):
+                q = queries[start:start + chunk_queries]
+                similarity, overlap = masked_similarity(entry, entry['matrix'][q].T, entry['valid'][q].T)
+                excluded = (overlap < entry['min_overlap']) | (entry['player_id'][:, None] == entry['player_id'][q][None, :])
+                similarity = np.where(excluded, -np.inf, similarity)
+                top = np.argpartition(-similarity, kk - 1, axis=0)[:kk]
+                top_scores = np.take_along_axis(similarity, top, axis=0)
+                order = np.argsort(-top_scores, axis=0, kind='stable')
+                top, top_scores = np.take_along_axis(top, order, axis=0).T, np.take_along_axis(top_scores, order, axis=0).T
+                found = np.isfinite(top_scores)
+                neighbours[q, :kk] = np.where(found, top, -1)
+                scores[q, :kk] = np.where(found, top_scores * 100, 0)
+        listed = neighbours.ravel()
+        has_neighbour = listed >= 0
+        order = np.argsort(listed[has_neighbour], kind='stable')
+        graph[group] = {
+            'neighbours': neighbours,
+            'scores': scores,
+            'reverse_sources': (np.flatnonzero(has_neighbour) // k).astype(np.int32)[order],
+            'reverse_offsets': np.searchsorted(listed[has_neighbour][order], np.arange(n + 1)).astype(np.int32),
+            'store': group_affinity['store'],
+        }
+    return graph
+
+@st.cache_resource(ttl=3600)
+def get_knn_graph_job(_df, dataset_version, metric_space="Standard", distance="Weighted Cosine"):
+    """
+    Starts building the kNN graph of `_df` on a background thread, once per dataset version,
+    metric space and similarity measure. The returned job's 'graph' is None until it is ready;
+    'error' holds the failure message if the build fails.
+    """
+    # Resolve the cached inputs here so the thread only does numpy work
+    similarity_index = get_similarity_index(_df, dataset_version, metric_space, distance)
+    affinity = get_archetype_affinity(_df, dataset_version, metric_space)
+    job = {'graph': None, 'error': None}
+
+    def build():
+        try:
+            job['graph'] = build_knn_graph(similarity_index, affinity)
+        except Exception as e:
+            job['error'] = str(e)
+
+    job['thread'] = threading.Thread(target=build, name=f"knn-graph-{metric_space}-{distance}", daemon=True)
+    job['thread'].start()
+    return job
+
+def knn_neighbours(group_graph, row, reverse=False):
+    """
+    Store rows and scores of a row's stored neighbours, or with `reverse` of the rows listing it
+    (scored as they list it), best first. Pure lookups into the kNN graph.
+    """
+    if reverse:
+        sources = group_graph['reverse_sources'][group_graph['reverse_offsets'][row]:group_graph['reverse_offsets'][row + 1]]
+        scores = group_graph['scores'][sources, np.argmax(group_graph['neighbours'][sources] == row, axis=1)].astype(np.float32)
+        order = np.argsort(-scores, kind='stable')
+        return sources[order], scores[order]
+    found = group_graph['neighbours'][row] >= 0
+    return group_graph['neighbours'][row][found], group_graph['scores'][row][found].astype(np.float32)
+
+@st.cache_resource(ttl=3600)
+def get_trajectory_index(_df, dataset_version, metric_space="Standard"):
+    """
+    Career-trajectory windows of every position group, built once per dataset version: each
+    player's seasons aligned by player_id and canonical_season (one row per season, the one with
+    most minutes) and, for every TRAJECTORY_LENGTHS, the store rows of each run of consecutive
+    seasons (oldest first). Also keeps each row's age at the end of its season, derived from
+    today's age.
+    """
+    index = {}
+    for group, store in get_metric_store(_df, dataset_version, metric_space).items():
+        player_id, season = store['player_id'], store['canonical_season']
+        order = np.lexsort((-np.nan_to_num(store['minutes']), season, player_id))
+        order = order[season[order] > 0]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (player_id[order][1:] != player_id[order][:-1]) | (season[order][1:] != season[order][:-1])
+        seasons = order[first]
+        windows = {}
+        for length in TRAJECTORY_LENGTHS:
+            ends = np.arange(length - 1, len(seasons))
+            # Seasons are unique per player and sorted, so a span of length - 1 years means consecutive
+            consecutive = (player_id[seasons[ends]] == player_id[seasons[ends - length + 1]]) & \
+                          (season[seasons[ends]] - season[seasons[ends - length + 1]] == length - 1)
+            ends = ends[consecutive]
+            windows[length] = seasons[ends[:, None] - np.arange(length - 1, -1, -1)].astype(np.int32)
+        index[group] = {'store': store, 'windows': windows, 'season_age': store['season_age']}
+    return index
+
+def _weighted_entry(vectors, valid, weights, distance):
+    """
+    An entry-like dict over arbitrary z-score vectors (e.g. flattened season sequences or team
+    styles) for masked_similarity, scored by weighted cosine or weighted Euclidean distance.
+    Mahalanobis needs a covariance these vectors do not have, so it falls back to Euclidean.
+    """
+    if distance == "Weighted Cosine":
+        scale = weights
+    else:
+        distance, scale = "Standardised Euclidean", np.sqrt(weights)
+    matrix = np.ascontiguousarray(vectors * scale, dtype=np.float32)
+    return {'distance': distance, 'weights': weights, 'matrix': matrix, 'matrix_sq': matrix ** 2, 'sq_norms': (matrix ** 2).sum(axis=1),
+            'valid': np.ascontiguousarray(valid, dtype=np.float32)}
+
+def find_trajectory_matches(df, trajectory_index, target_player, metrics, length=3, align='season', progression=False,
+                            distance="Weighted Cosine", min_minutes=0, top_k=20, weights=None):
+    """
+    Players whose `length` consecutive seasons in `metrics` resemble the target's run of seasons
+    ending with the target's season, one (best) window per player. With align 'age' only windows
+    covering the same ages as the target's count. With `progression`, each season is taken
+    relative to the window's first season, so the shape of the arc matters rather than its level.
+    Every season of a window needs `min_minutes`. The target must be a row of `df`.
+    """
+    group_index = trajectory_index.get(target_player['position_group'])
+    if group_index is None:
+        return pd.DataFrame()
+    store, windows = group_index['store'], group_index['windows'][length]
+    ends = windows[:, -1]
+    own = np.flatnonzero((store['player_id'][ends] == target_player['player_id']) &
+                         (store['canonical_season'][ends] == target_player['canonical_season']))
+    columns = [store['metric_index'][m] for m in metrics if m in store['metric_index']]
+    if len(own) == 0 or not columns:
         return pd.DataFrame()
 
-    # Filter to available metrics
-    available_z_metrics = [m for m in z_metrics if m in pool_df.columns and m in target_player.index]
-    if not available_z_metrics:
+    vectors = store['z'][windows][:, :, columns]
+    valid = store['valid'][windows][:, :, columns]
+    if progression:
+        vectors, valid = vectors[:, 1:] - vectors[:, :1], valid[:, 1:] * valid[:, :1]
+    steps = vectors.shape[1]
+    metric_weights = np.ones(len(columns), dtype=np.float32) if weights is None else np.asarray(weights, dtype=np.float32)
+    entry = _weighted_entry(vectors.reshape(len(windows), -1), valid.reshape(len(windows), -1), np.tile(metric_weights, steps), distance)
+
+    target = own[0]
+    similarity, overlap = masked_similarity(entry, entry['matrix'][target], entry['valid'][target])
+    pool = (store['player_id'][ends] != target_player['player_id']) & (store['minutes'][windows] >= min_minutes).all(axis=1)
+    pool &= overlap >= np.ceil(MIN_METRIC_OVERLAP * steps * len(columns))
+    if align == 'age':
+        pool &= np.round(group_index['season_age'][ends]) == np.round(group_index['season_age'][ends[target]])
+    candidates = np.flatnonzero(pool)
+    if len(candidates) == 0:
         return pd.DataFrame()
-    
-    omitted_count = len(z_metrics) - len(available_z_metrics)
+    candidates = candidates[best_row_per_player(store['player_id'][ends[candidates]], similarity[candidates])]
+    score = similarity[candidates]
+    if top_k is not None and top_k < len(score):
+        top = np.argpartition(-score, top_k - 1)[:top_k]
+        order = top[np.argsort(-score[top], kind='stable')]
+    else:
+        order = np.argsort(-score, kind='stable')
+
+    chosen = candidates[order]
+    matches = df.iloc[store['rows'][ends[chosen]]]
+    matches.attrs['pool_size'] = len(candidates)
+    first_season = df['season_name'].iloc[store['rows'][windows[chosen, 0]]].to_numpy()
+    first_age, last_age = group_index['season_age'][windows[chosen, 0]], group_index['season_age'][ends[chosen]]
+    matches['trajectory_seasons'] = [f"{a} to {b}" for a, b in zip(first_season, matches['season_name'])]
+    matches['trajectory_ages'] = [f"{int(a)}-{int(b)}" if not np.isnan(a) else "N/A" for a, b in zip(first_age, last_age)]
+    matches['trajectory_score'] = similarity[chosen] * 100
+    return matches
+
+def _dominates(a, b):
+    """Pareto dominance (higher is better) of rows of `a` over rows of `b`, broadcasting over leading axes."""
+    return (a >= b).all(axis=-1) & (a > b).any(axis=-1)
+
+def skyline(points, scores=None, limit=None):
+    """
+    Row indices of the Pareto-optimal rows of `points` (every column maximised), by block
+    sort-filter-skyline. Rows are visited in descending order of `scores` (default: row sums; any
+    score strictly increasing under dominance works), so a row can only be dominated by rows
+    before it and each block is checked against the skyline so far and itself. The skyline comes
+    out in score order, so with `limit` the scan stops once that many optimal rows are found.
+    """
+    order = np.argsort(-(points.sum(axis=1) if scores is None else scores), kind='stable')
+    optimal = np.empty(0, dtype=np.int64)
+    for start in range(0, len(order), SKYLINE_BLOCK_SIZE):
+        block = order[start:start + SKYLINE_BLOCK_SIZE]
+        block_points = points[block]
+        dominated = _dominates(block_points[None, :, :], block_points[:, None, :]).any(axis=1)
+        if len(optimal):
+            dominated |= _dominates(points[optimal][None, :, :], block_points[:, None, :]).any(axis=1)
+        optimal = np.concatenate([optimal, block[~dominated]])
+        if limit is not None and len(optimal) >= limit:
+            return optimal[:limit]
+    return optimal
+
+def pareto_layers(points, scores=None, min_rows=None):
+    """
+    Pareto layer of every row (1 = skyline, 2 = skyline once layer 1 is removed, ...), peeling
+    until at least `min_rows` rows are layered. The last layer may then hold only its `min_rows`
+    best rows by `scores`; rows left unpeeled get layer 0.
+    """
+    layers = np.zeros(len(points), dtype=np.int64)
+    remaining = np.arange(len(points))
+    layer, layered = 0, 0
+    while len(remaining) and (min_rows is None or layered < min_rows):
+        layer += 1
+        optimal = remaining[skyline(points[remaining], None if scores is None else scores[remaining],
+                                    None if min_rows is None else min_rows - layered)]
+        layers[optimal] = layer
+        layered += len(optimal)
+        remaining = remaining[layers[remaining] == 0]
+    return layers
+
+def metric_contributions(entry, target_vector, target_valid, rows, target_z):
+    """
+    Per-metric breakdown of the similarity of entry `rows` to a mapped target, as one elementwise
+    product over the k x m slice, plus the z-score deviations (candidate minus `target_z`, the
+    target's unmapped z-scores) on the metrics both players have (NaN elsewhere). For cosine each metric's term of the weighted dot
+    product is scaled so the row sums to the similarity (x 100, like similarity_score); for the
+    distances each row is the metric's share (%) of the squared distance, with Mahalanobis
+    cross-terms attributed through the covariance so the shares still sum to 100.
+    """
+    mapped = entry['matrix'][rows]
+    shared = entry['valid'][rows] * target_valid
+    z_difference = entry['z'][np.ix_(rows, entry['columns'])] - np.nan_to_num(target_z)
+    deviation = np.where(shared > 0, z_difference, np.nan)
+    if entry['distance'] == "Weighted Cosine":
+        terms = mapped * target_vector * shared
+        denominator = np.sqrt((mapped ** 2 * shared).sum(axis=1) * (target_vector ** 2 * shared).sum(axis=1))
+        return 100 * terms / np.where(denominator > 0, denominator, 1)[:, None], deviation
+    difference = mapped - target_vector
+    if entry['distance'] == "Mahalanobis":
+        terms = z_difference * (difference @ entry['transform'].T)
+    else:
+        terms = (difference * shared) ** 2
+    total = terms.sum(axis=1)
+    return 100 * terms / np.where(total > 0, total, 1)[:, None], deviation
+
+def _add_contributions(matches, entry, target_player, target_vector, target_valid, rows):
+    """Adds contribution_<metric> columns and the largest positive / negative deviation labels."""
+    contributions, deviation = metric_contributions(entry, target_vector, target_valid, rows, _target_z(entry, target_player))
+    for j, metric in enumerate(entry['metrics']):
+        matches[f"contribution_{metric}"] = contributions[:, j]
+    filled = np.nan_to_num(deviation, nan=0.0)
+    for column, pick in (('largest_positive_deviation', np.argmax), ('largest_negative_deviation', np.argmin)):
+        at = pick(filled, axis=1)
+        value = filled[np.arange(len(filled)), at]
+        matches[column] = [f"{metric_label(entry['metrics'][j])} ({v:+.1f})" if (v > 0 if pick is np.argmax else v < 0) else ""
+                           for j, v in zip(at, value)]
+    return matches
+
+def best_row_per_player(player_ids, score):
+    """Positions of each player's highest-scoring row (grouped arg-max), in their original order."""
+    order = np.lexsort((-score, player_ids))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = player_ids[order][1:] != player_ids[order][:-1]
+    return np.sort(order[first])
+
+def mmr_order(entry, candidates, relevance, k, diversity, pool_size=MMR_POOL_SIZE):
+    """
+    Maximal-marginal-relevance ranking of the best `pool_size` candidates by `relevance` (0-1):
+    each pick maximises (1 - diversity) * relevance - diversity * its highest cosine similarity
+    to the picks so far. Returns positions into `candidates` for the first k picks.
+    """
+    pool = np.argsort(-relevance, kind='stable')[:max(pool_size, k)]
+    vectors = entry['matrix'][candidates[pool]]
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    redundancy = vectors @ vectors.T
+    gain = (1 - diversity) * relevance[pool]
+    closest = np.zeros(len(pool), dtype=np.float32)
+    available = np.ones(len(pool), dtype=bool)
+    picks = []
+    for _ in range(min(k, len(pool))):
+        pick = int(np.argmax(np.where(available, gain - diversity * closest, -np.inf)))
+        picks.append(pick)
+        available[pick] = False
+        closest = np.maximum(closest, redundancy[:, pick])
+    return pool[picks]
+
+def build_pool_mask(entry, target_player, min_minutes=600, seasons=None, competition_ids=None, age_range=None):
+    """
+    Boolean search-pool mask over an index entry's rows. Players with unknown age are kept
+    when an age range is applied; in the Age-Adjusted space the range applies to season age, the
+    age each row was ranked at. The target player, if given, is always excluded.
+    """
+    mask = entry['minutes'] >= min_minutes
+    if target_player is not None:
+        mask &= entry['player_id'] != target_player['player_id']
+    if seasons is not None:
+        mask &= np.isin(entry['canonical_season'], list(seasons))
+    if competition_ids is not None:
+        mask &= np.isin(entry['competition_id'], list(competition_ids))
+    if age_range is not None:
+        age = entry['season_age'] if entry.get('suffixes') == METRIC_SPACES['Age-Adjusted'] else entry['age']
+        mask &= np.isnan(age) | ((age >= age_range[0]) & (age <= age_range[1]))
+    return mask
+
+def _target_z(entry, target_player):
+    """The target's z-scores on an entry's metrics (in the entry's metric space), NaN where missing."""
+    z_suffix = entry['suffixes']['z']
+    return np.array([target_player.get(f"{m}{z_suffix}", np.nan) for m in entry['metrics']], dtype=np.float32)
+
+def _target_vector(entry, target_player):
+    """The target's mapped z-score vector (missing metrics as 0) and its validity bitmap."""
+    values = _target_z(entry, target_player)
+    return np.nan_to_num(values) @ entry['transform'], (~np.isnan(values)).astype(np.float32)
+
+def find_matches(target_player, pool_df, archetype_config, search_mode='similar', min_minutes=600, metric_space="Standard",
+                 entry=None, pool_mask=None, top_k=None, ann=None, scores=None, distance="Weighted Cosine",
+                 dominance_share=PARETO_DOMINANCE_SHARE, best_per_player=False, diversity=0.0, explain=False):
+    """
+    Finds similar players using z-scores and a similarity measure (see SIMILARITY_MEASURES; a
+    precompiled entry carries its own) in the chosen metric space.
+    With a precompiled `entry` from get_similarity_index, `pool_df` must be the frame the index was
+    built from and `pool_mask` (see build_pool_mask) selects the search pool, so a query is one
+    matrix-vector product plus a mask. Without an entry, `pool_df` is the search pool itself.
+    With `top_k`, only the k best rows are selected (partial selection, no full sort) and
+    materialised; the size of the whole candidate pool is kept in `attrs['pool_size']`.
+    With an `ann` index (see get_ann_indexes), top-k similarity queries over pools of at least
+    ANN_MIN_POOL rows only score the rows the index proposes; `attrs['approximate']` records it.
+    `scores` is a precomputed masked_similarity() (similarity, overlap) pair over all entry rows
+    (e.g. from the result cache), so filter changes only re-apply the pool mask. Candidates sharing
+    fewer than the entry's min_overlap metrics with the target are dropped; `metrics_compared`
+    reports the overlap of each match.
+    search_mode 'pareto' keeps candidates whose percentile beats the target's on at least
+    `dominance_share` of the identity metrics and orders them by Pareto layer (skyline first),
+    then by upgrade score.
+    `best_per_player` collapses the pool to each player's best-scoring row; `diversity` (0-1)
+    re-ranks the best MMR_POOL_SIZE candidates by maximal marginal relevance.
+    `explain` adds the per-metric breakdown of the returned rows (see metric_contributions).
+    """
+    if entry is None:
+        pool_df = pool_df[pool_df['position_group'] == target_player['position_group']]
+        if pool_df.empty:
+            return pd.DataFrame()
+        entry = compile_archetype_entry(_build_group_store(pool_df, np.arange(len(pool_df)), metric_space), archetype_config, distance)
+
+    if not entry['metrics']:
+        return pd.DataFrame()
+    omitted_count = entry['n_requested'] - len(entry['metrics'])
     if omitted_count > 0:
-        st.warning(f"Some metrics omitted from similarity calculation: {omitted_count} out of {len(z_metrics)} metrics not available.")
+        st.warning(f"Some metrics omitted from similarity calculation: {omitted_count} out of {entry['n_requested']} metrics not available.")
 
-    target_vector = target_player[available_z_metrics].fillna(0).values.reshape(1, -1)
-    pool_matrix = pool_df[available_z_metrics].fillna(0).values
-    
-    weights = np.full(len(available_z_metrics), key_weight)
-    target_vector_w = target_vector * weights
-    pool_matrix_w = pool_matrix * weights
-    
-    similarities = cosine_similarity(target_vector_w, pool_matrix_w)
-    pool_df['similarity_score'] = similarities[0] * 100
-    
+    if pool_mask is None:
+        pool_mask = build_pool_mask(entry, target_player, min_minutes)
+    else:
+        pool_mask = pool_mask & (entry['minutes'] >= min_minutes) & (entry['player_id'] != target_player['player_id'])
+    candidates = np.flatnonzero(pool_mask)
+    if len(candidates) == 0:
+        return pd.DataFrame()
+
+    pool_size = len(candidates)
+    target_vector, target_valid = _target_vector(entry, target_player)
+    approximate = scores is None and ann is not None and search_mode == 'similar' and top_k is not None and pool_size >= ANN_MIN_POOL
+    if scores is not None:
+        similarity, overlap = scores[0][candidates], scores[1][candidates]
+    elif approximate:
+        candidates = ann_candidates(ann, target_vector, pool_mask, top_k)
+        similarity, overlap = masked_similarity(entry, target_vector, target_valid, candidates)
+    else:
+        similarity, overlap = masked_similarity(entry, target_vector, target_valid)
+        similarity, overlap = similarity[candidates], overlap[candidates]
+    comparable = overlap >= entry['min_overlap']
+    candidates, similarity, overlap = candidates[comparable], similarity[comparable] * 100, overlap[comparable]
+    if not approximate:
+        pool_size = len(candidates)
+    if len(candidates) == 0:
+        return pd.DataFrame()
+    if search_mode == 'pareto':
+        pct_suffix = entry['suffixes']['pct']
+        target_pct = np.array([target_player.get(f"{m}{pct_suffix}", 0.0) for m in entry['metrics']], dtype=np.float32)
+        metrics_beaten = ((entry['pct'][candidates] > np.nan_to_num(target_pct)) & (entry['valid'][candidates] > 0)).sum(axis=1)
+        upgrades = metrics_beaten >= np.ceil(dominance_share * len(entry['metrics']))
+        candidates, similarity, overlap, metrics_beaten = (a[upgrades] for a in (candidates, similarity, overlap, metrics_beaten))
+        if best_per_player:
+            best = best_row_per_player(entry['player_id'][candidates], entry['upgrade_score'][candidates])
+            candidates, similarity, overlap, metrics_beaten = (a[best] for a in (candidates, similarity, overlap, metrics_beaten))
+        pool_size = len(candidates)
+        if pool_size == 0:
+            return pd.DataFrame()
+        layers = pareto_layers(entry['pct'][candidates], entry['upgrade_score'][candidates], top_k)
+        layered = np.flatnonzero(layers > 0)
+        order = layered[np.lexsort((-entry['upgrade_score'][candidates[layered]], layers[layered]))][:top_k]
+        matches = pool_df.iloc[entry['rows'][candidates[order]]]
+        matches.attrs['pool_size'] = pool_size
+        matches.attrs['approximate'] = False
+        matches['similarity_score'] = similarity[order]
+        matches['metrics_compared'] = overlap[order].astype(int)
+        matches['pareto_layer'] = layers[order]
+        matches['metrics_beaten'] = metrics_beaten[order]
+        matches['upgrade_score'] = entry['upgrade_score'][candidates[order]]
+        if explain:
+            _add_contributions(matches, entry, target_player, target_vector, target_valid, candidates[order])
+        return matches
+
+    score = entry['upgrade_score'][candidates] if search_mode == 'upgrade' else similarity
+    if best_per_player:
+        best = best_row_per_player(entry['player_id'][candidates], score)
+        candidates, similarity, overlap, score = candidates[best], similarity[best], overlap[best], score[best]
+        if not approximate:
+            pool_size = len(candidates)
+    if diversity > 0:
+        order = mmr_order(entry, candidates, score / 100, top_k or MMR_POOL_SIZE, diversity)
+        if top_k is None:
+            rest = np.setdiff1d(np.arange(len(score)), order)
+            order = np.concatenate([order, rest[np.argsort(-score[rest], kind='stable')]])
+    elif top_k is not None and top_k < len(score):
+        top = np.argpartition(-score, top_k - 1)[:top_k]
+        order = top[np.argsort(-score[top], kind='stable')]
+    else:
+        order = np.argsort(-score, kind='stable')
+
+    matches = pool_df.iloc[entry['rows'][candidates[order]]]
+    matches.attrs['pool_size'] = pool_size
+    matches.attrs['approximate'] = approximate
+    matches['similarity_score'] = similarity[order]
+    matches['metrics_compared'] = overlap[order].astype(int)
     if search_mode == 'upgrade':
-        pct_metrics = [f'{m}_pct' for m in key_identity_metrics]
-        available_pct_metrics = [m for m in pct_metrics if m in pool_df.columns]
-        if available_pct_metrics:
-            pool_df['upgrade_score'] = pool_df[available_pct_metrics].mean(axis=1)
+        matches['upgrade_score'] = score[order]
+    if explain:
+        _add_contributions(matches, entry, target_player, target_vector, target_valid, candidates[order])
+    return matches
+
+def find_replacements_batch(targets, pool_df, similarity_index, metric_space="Standard", min_minutes=600, top_k=10,
+                            search_scope=None, competition_ids=None, age_range=None, chunk_rows=BATCH_CHUNK_ROWS, affinity=None):
+    """
+    Replacement search for many target player-seasons at once, e.g. a whole squad. Targets are
+    grouped by position group and detected archetype; each group is scored against its pool with
+    chunked matrix-matrix products while a running top-k is kept per target, so memory stays
+    bounded by chunk_rows x targets. Returns one table of the top_k matches for every target.
+    With the `affinity` of `pool_df` (see get_archetype_affinity), archetypes are row lookups.
+    """
+    jobs = {}
+    for _, target in targets.iterrows():
+        group = target['position_group']
+        if pd.isna(group) or group not in POSITIONAL_CONFIGS:
+            continue
+        if affinity is not None:
+            archetype, _ = lookup_player_archetype(affinity, pool_df, target, POSITIONAL_CONFIGS[group]['archetypes'], metric_space)
         else:
-            pool_df['upgrade_score'] = 0
-        return pool_df.sort_values('upgrade_score', ascending=False)
+            archetype, _ = detect_player_archetype(target, POSITIONAL_CONFIGS[group]['archetypes'], metric_space)
+        if archetype:
+            jobs.setdefault((group, archetype), []).append(target)
+
+    parts = []
+    for (group, archetype), group_targets in jobs.items():
+        entry = get_archetype_entry(similarity_index, group, archetype, POSITIONAL_CONFIGS[group]['archetypes'][archetype])
+        if entry is None or not entry['metrics']:
+            continue
+        seasons = seasons_in_scope(entry['canonical_season'], search_scope) if search_scope else None
+        pool_mask = build_pool_mask(entry, None, min_minutes, seasons, competition_ids, age_range)
+        mapped_targets = [_target_vector(entry, t) for t in group_targets]
+        target_vectors = np.stack([vector for vector, _ in mapped_targets], axis=1)
+        target_valid = np.stack([valid for _, valid in mapped_targets], axis=1)
+        target_ids = np.array([t['player_id'] for t in group_targets])
+
+        best_scores = np.empty((0, len(group_targets)), dtype=np.float32)
+        best_overlap = np.empty((0, len(group_targets)), dtype=np.float32)
+        best_rows = np.empty((0, len(group_targets)), dtype=np.int64)
+        for start in range(0, len(entry['matrix']), chunk_rows):
+            stop = min(start + chunk_rows, len(entry['matrix']))
+            scores, overlap = masked_similarity(entry, target_vectors, target_valid, slice(start, stop))
+            excluded = (~pool_mask[start:stop, None] | (entry['player_id'][start:stop, None] == target_ids[None, :])
+                        | (overlap < entry['min_overlap']))
+            scores = np.vstack([best_scores, np.where(excluded, -np.inf, scores)])
+            overlap = np.vstack([best_overlap, overlap])
+            rows = np.vstack([best_rows, np.broadcast_to(np.arange(start, stop)[:, None], excluded.shape)])
+            if len(scores) > top_k:
+                keep = np.argpartition(-scores, top_k - 1, axis=0)[:top_k]
+                scores, overlap, rows = (np.take_along_axis(a, keep, axis=0) for a in (scores, overlap, rows))
+            best_scores, best_overlap, best_rows = scores, overlap, rows
+
+        order = np.argsort(-best_scores, axis=0, kind='stable')
+        best_scores, best_overlap, best_rows = (np.take_along_axis(a, order, axis=0) for a in (best_scores, best_overlap, best_rows))
+        rank, target_idx = np.nonzero(np.isfinite(best_scores))
+        part = pool_df.iloc[entry['rows'][best_rows[rank, target_idx]]].reset_index(drop=True)
+        part.insert(0, 'metrics_compared', best_overlap[rank, target_idx].astype(int))
+        part.insert(0, 'similarity_score', best_scores[rank, target_idx] * 100)
+        part.insert(0, 'rank', rank + 1)
+        part.insert(0, 'archetype', archetype)
+        for col in ('team_name', 'player_name'):
+            part.insert(0, f'target_{col}', [group_targets[j][col] for j in target_idx])
+        parts.append(part)
+
+    if not parts:
+        return pd.DataFrame()
+    return pd.concat(parts, ignore_index=True).sort_values(['target_player_name', 'rank'], kind='stable').reset_index(drop=True)
+
+def union_archetype_config(archetypes, names):
+    """One archetype-style config covering the identity metrics of several archetypes, each metric at its highest weight."""
+    metric_weights = {}
+    for name in names:
+        config = archetypes[name]
+        for metric, weight in zip(config['identity_metrics'], archetype_metric_weights(config, config['identity_metrics'])):
+            metric_weights[metric] = max(metric_weights.get(metric, 0.0), float(weight))
+    return {
+        'description': "Union of " + ", ".join(names) + ".",
+        'identity_metrics': list(metric_weights),
+        'metric_weights': metric_weights,
+    }
+
+def find_composite_matches(contributors, pool_df, similarity_index, group, archetype_name=None, weights=None, objective='centroid',
+                           metric_space="Standard", min_minutes=600, top_k=20, search_scope=None, competition_ids=None,
+                           age_range=None, affinity=None):
+    """
+    Players in `group` similar to a blend of several contributor player-seasons. With objective
+    'centroid' candidates are ranked against the weighted centroid of the contributors' z-scores;
+    with 'coverage' by their lowest similarity to any contributor, so they must resemble all of
+    them. Searches the named archetype, or the union of the contributors' detected archetypes.
+    The centroid and every contributor are scored in one matrix-matrix product, and each match
+    carries its similarity to every contributor (similarity_to_0, similarity_to_1, ...).
+    """
+    archetypes = POSITIONAL_CONFIGS[group]['archetypes']
+    if archetype_name is None:
+        detected = set()
+        for contributor in contributors:
+            if affinity is not None:
+                detected.add(lookup_player_archetype(affinity, pool_df, contributor, archetypes, metric_space)[0])
+            else:
+                detected.add(detect_player_archetype(contributor, archetypes, metric_space)[0])
+        names = [name for name in archetypes if name in detected]
+        archetype_name = names[0] if len(names) == 1 else None
+    if archetype_name is not None:
+        label = archetype_name
+        entry = get_archetype_entry(similarity_index, group, archetype_name, archetypes[archetype_name])
+    else:
+        label = " + ".join(names)
+        group_store = similarity_index['store'].get(group)
+        entry = compile_archetype_entry(group_store, union_archetype_config(archetypes, names), similarity_index['distance']) if group_store is not None else None
+    if entry is None or not entry['metrics']:
+        return pd.DataFrame()
+
+    weights = np.ones(len(contributors)) if weights is None else np.asarray(weights, dtype=float)
+    z = np.stack([_target_z(entry, contributor) for contributor in contributors])
+    valid = ~np.isnan(z)
+    weight_present = (weights[:, None] * valid).sum(axis=0)
+    centroid = np.nansum(z * weights[:, None], axis=0) / np.where(weight_present > 0, weight_present, 1)
+    targets_z = np.vstack([centroid, np.nan_to_num(z)])
+    targets_valid = np.vstack([weight_present > 0, valid]).astype(np.float32)
+    similarity, overlap = masked_similarity(entry, (targets_z @ entry['transform']).T.astype(np.float32), targets_valid.T)
+
+    seasons = seasons_in_scope(entry['canonical_season'], search_scope) if search_scope else None
+    pool_mask = build_pool_mask(entry, None, min_minutes, seasons, competition_ids, age_range)
+    pool_mask &= ~np.isin(entry['player_id'], [contributor['player_id'] for contributor in contributors])
+    if objective == 'coverage':
+        score = similarity[:, 1:].min(axis=1)
+        pool_mask &= (overlap[:, 1:] >= entry['min_overlap']).all(axis=1)
+    else:
+        score = similarity[:, 0]
+        pool_mask &= overlap[:, 0] >= entry['min_overlap']
+    candidates = np.flatnonzero(pool_mask)
+    if len(candidates) == 0:
+        return pd.DataFrame()
+    if top_k < len(candidates):
+        candidates = candidates[np.argpartition(-score[candidates], top_k - 1)[:top_k]]
+    candidates = candidates[np.argsort(-score[candidates], kind='stable')]
+
+    matches = pool_df.iloc[entry['rows'][candidates]]
+    matches.attrs['pool_size'] = int(pool_mask.sum())
+    matches.attrs['archetype'] = label
+    matches.attrs['contributors'] = [f"{c['player_name']} ({c['season_name']})" for c in contributors]
+    matches['composite_score'] = score[candidates] * 100
+    for i in range(len(contributors)):
+        matches[f'similarity_to_{i}'] = similarity[candidates, i + 1] * 100
+    return matches
+
+def _team_memberships(df):
+    """
+    One row per (row of `df`, club) with the row's position `row` and its minutes as `weight`;
+    merged multi-team rows are split evenly across their clubs. Heaviest memberships first.
+    """
+    teams = df['team_name'].str.split(TEAM_NAME_SEPARATOR, regex=False)
+    members = pd.DataFrame({
+        'row': np.arange(len(df)), 'team_name': teams.to_numpy(), 'season_name': df['season_name'].to_numpy(),
+        'position_group': df['position_group'].to_numpy(), 'league_name': df['league_name'].to_numpy(),
+        'competition_id': df['competition_id'].to_numpy(), 'canonical_season': df['canonical_season'].to_numpy(),
+        'player_id': df['player_id'].to_numpy(), 'age': df['age'].to_numpy(dtype=float),
+        'weight': df['minutes'].fillna(0).to_numpy(dtype=float) / teams.str.len().fillna(1).to_numpy(),
+    }).explode('team_name')
+    return members.dropna(subset=['team_name']).sort_values('weight', ascending=False, kind='stable')
+
+@st.cache_resource(ttl=3600)
+def get_team_styles(_df, dataset_version, metric_space="Standard", by_group=False):
+    """
+    Team style vectors: the minutes-weighted mean z-scores of each team's players per team_name
+    and season (and position group with `by_group`), in one grouped pass, cached per dataset
+    version. Players who moved mid-season count for each of their clubs with their minutes split
+    evenly. Team and player vectors are kept as masked-cosine entries, so fitting one player to
+    every team, or every player to a team, is a single matrix-vector product.
+    """
+    z_suffix = METRIC_SPACES[metric_space]['z']
+    metrics = [m for m in ALL_METRICS_TO_PERCENTILE if f"{m}{z_suffix}" in _df.columns]
+    z = _df[[f"{m}{z_suffix}" for m in metrics]].to_numpy(dtype=np.float32)
+    valid = ~np.isnan(z)
+    keys = ['team_name', 'season_name'] + (['position_group'] if by_group else [])
+
+    members = _team_memberships(_df).dropna(subset=keys)
+    grouped = members.groupby(keys, sort=True)
+    codes = grouped.ngroup().to_numpy()
+    rows, weight = members['row'].to_numpy(dtype=np.int64), members['weight'].to_numpy(dtype=np.float32)[:, None]
+    weighted_sum = pd.DataFrame(np.nan_to_num(z[rows]) * weight).groupby(codes).sum().to_numpy()
+    weight_sum = pd.DataFrame(valid[rows] * weight).groupby(codes).sum().to_numpy()
+    team_matrix = np.where(weight_sum > 0, weighted_sum / np.where(weight_sum > 0, weight_sum, 1), 0)
+
+    # Heaviest member first, so 'first' picks each team's main competition
+    team_keys = grouped.agg(league_name=('league_name', 'first'), competition_id=('competition_id', 'first'),
+                            canonical_season=('canonical_season', 'first'), minutes=('weight', 'sum'),
+                            players=('player_id', 'nunique')).reset_index()
+    weights = np.ones(len(metrics), dtype=np.float32)
+    return {
+        'metrics': metrics, 'z_suffix': z_suffix, 'by_group': by_group, 'teams': team_keys,
+        'team_entry': _weighted_entry(team_matrix, weight_sum > 0, weights, "Weighted Cosine"),
+        'player_entry': _weighted_entry(np.nan_to_num(z), valid, weights, "Weighted Cosine"),
+        'min_overlap': int(np.ceil(MIN_METRIC_OVERLAP * len(metrics))),
+    }
+
+def team_fit_scores(styles, player, seasons=None, competition_ids=None, top_k=20):
+    """
+    Best-fit clubs for `player`: masked cosine of the player's z-scores against every team style
+    vector (the team's vector for the player's position group when styles are by group), ranked.
+    """
+    values = np.array([player.get(f"{m}{styles['z_suffix']}", np.nan) for m in styles['metrics']], dtype=np.float32)
+    similarity, overlap = masked_similarity(styles['team_entry'], np.nan_to_num(values), (~np.isnan(values)).astype(np.float32))
+    teams = styles['teams']
+    pool = overlap >= styles['min_overlap']
+    if styles['by_group']:
+        pool &= (teams['position_group'] == player['position_group']).to_numpy()
+    if seasons is not None:
+        pool &= teams['canonical_season'].isin(list(seasons)).to_numpy()
+    if competition_ids is not None:
+        pool &= teams['competition_id'].isin(competition_ids).to_numpy()
+    candidates = np.flatnonzero(pool)
+    if top_k is not None and top_k < len(candidates):
+        candidates = candidates[np.argpartition(-similarity[candidates], top_k - 1)[:top_k]]
+    candidates = candidates[np.argsort(-similarity[candidates], kind='stable')]
+    fits = teams.iloc[candidates].copy()
+    fits.attrs['pool_size'] = int(pool.sum())
+    fits['fit_score'] = similarity[candidates] * 100
+    return fits
+
+def players_fit_to_team(df, styles, team_name, season_name, min_minutes=0, seasons=None, competition_ids=None,
+                        position_groups=None, top_k=20):
+    """
+    Players of `df` (the frame the styles were built from) ranked by fit to a team's style. With
+    styles by group, every player is scored against the team's vector for their own group: all
+    group vectors are stacked as targets of one matrix product and each row picks its column.
+    """
+    teams = styles['teams']
+    team_rows = np.flatnonzero(((teams['team_name'] == team_name) & (teams['season_name'] == season_name)).to_numpy())
+    if len(team_rows) == 0:
+        return pd.DataFrame()
+    team_entry = styles['team_entry']
+    similarity, overlap = masked_similarity(styles['player_entry'], team_entry['matrix'][team_rows].T, team_entry['valid'][team_rows].T)
+    if styles['by_group']:
+        column = pd.Series(np.arange(len(team_rows)), index=teams['position_group'].iloc[team_rows].to_numpy())
+        picked = column.reindex(df['position_group'].to_numpy()).to_numpy()
+        has_group = ~np.isnan(picked)
+        picked = np.where(has_group, picked, 0).astype(int)
+        similarity = np.where(has_group, similarity[np.arange(len(df)), picked], -np.inf)
+        overlap = overlap[np.arange(len(df)), picked]
     else:
-        return pool_df.sort_values('similarity_score', ascending=False)
+        similarity, overlap = similarity[:, 0], overlap[:, 0]
+
+    pool = (overlap >= styles['min_overlap']) & np.isfinite(similarity) & (df['minutes'].to_numpy() >= min_minutes)
+    # The team's own players are not candidates
+    names = df['team_name'].fillna('')
+    pool &= ~((names == team_name) | names.str.startswith(team_name + TEAM_NAME_SEPARATOR) |
+              names.str.endswith(TEAM_NAME_SEPARATOR + team_name) | names.str.contains(TEAM_NAME_SEPARATOR + team_name + TEAM_NAME_SEPARATOR, regex=False)).to_numpy()
+    if seasons is not None:
+        pool &= df['canonical_season'].isin(list(seasons)).to_numpy()
+    if competition_ids is not None:
+        pool &= df['competition_id'].isin(competition_ids).to_numpy()
+    if position_groups is not None:
+        pool &= df['position_group'].isin(position_groups).to_numpy()
+    candidates = np.flatnonzero(pool)
+    if top_k is not None and top_k < len(candidates):
+        candidates = candidates[np.argpartition(-similarity[candidates], top_k - 1)[:top_k]]
+    candidates = candidates[np.argsort(-similarity[candidates], kind='stable')]
+    fits = df.iloc[candidates].copy()
+    fits.attrs['pool_size'] = int(pool.sum())
+    fits['fit_score'] = similarity[candidates] * 100
+    return fits
+
+@st.cache_resource(ttl=3600)
+def get_squad_profiles(_df, dataset_version, metric_space="Standard"):
+    """
+    Squad aggregates per (team_name, season_name, position_group) in one grouped pass, cached per
+    dataset version. Each squad gets a minutes-weighted percentile profile over every metric,
+    depth (players, regulars with SQUAD_REGULAR_MINUTES+, minutes) and age structure. Age
+    structure is the minutes-weighted mean age and the minutes share per AGE_BANDS band, using
+    ages at the end of each season. Each team-season also gets a squad-shape vector (its group
+    profiles side by side, centred on the 50th percentile) for similar_squads.
+    """
+    pct_suffix = METRIC_SPACES[metric_space]['pct']
+    metrics = [m for m in ALL_METRICS_TO_PERCENTILE if f"{m}{pct_suffix}" in _df.columns]
+    pct = _df[[f"{m}{pct_suffix}" for m in metrics]].to_numpy(dtype=np.float32)
+    keys = ['team_name', 'season_name', 'position_group']
+
+    members = _team_memberships(_df).dropna(subset=keys)
+    members['season_age'] = _df['season_age'].to_numpy(dtype=float)[members['row'].to_numpy(dtype=int)]
+    members['age_weight'] = members['weight'].where(members['season_age'].notna(), 0.0)
+    members['weighted_age'] = members['season_age'].fillna(0) * members['age_weight']
+    members['regular'] = members['weight'] >= SQUAD_REGULAR_MINUTES
+    band = pd.cut(members['season_age'], bins=[lo for lo, _ in AGE_BANDS] + [AGE_BANDS[-1][1] + 1], right=False, labels=False)
+    band_columns = [f"minutes_share_{lo}_{hi}" for lo, hi in AGE_BANDS]
+    for b, column in enumerate(band_columns):
+        members[column] = members['weight'] * (band == b)
+
+    grouped = members.groupby(keys, sort=True)
+    codes = grouped.ngroup().to_numpy()
+    weight = members['weight'].to_numpy(dtype=np.float32)[:, None]
+    weighted_sum = pd.DataFrame(pct[members['row'].to_numpy(dtype=np.int64)] * weight).groupby(codes).sum().to_numpy()
+    squads = grouped.agg(league_name=('league_name', 'first'), competition_id=('competition_id', 'first'),
+                         canonical_season=('canonical_season', 'first'), players=('player_id', 'nunique'),
+                         regulars=('regular', 'sum'), minutes=('weight', 'sum'), age_weight=('age_weight', 'sum'),
+                         weighted_age=('weighted_age', 'sum'), **{c: (c, 'sum') for c in band_columns}).reset_index()
+    minutes = squads['minutes'].to_numpy()
+    profiles = (weighted_sum / np.where(minutes > 0, minutes, 1)[:, None]).astype(np.float32)
+    squads['mean_age'] = squads['weighted_age'] / squads['age_weight'].where(squads['age_weight'] > 0)
+    squads[band_columns] = squads[band_columns].div(squads['minutes'].where(squads['minutes'] > 0), axis=0) * 100
+    squads = squads.drop(columns=['age_weight', 'weighted_age'])
+
+    groups = list(POSITIONAL_CONFIGS)
+    team_codes = squads.groupby(['team_name', 'season_name'], sort=True).ngroup().to_numpy()
+    teams = squads.groupby(['team_name', 'season_name'], sort=True).agg(
+        league_name=('league_name', 'first'), competition_id=('competition_id', 'first'),
+        canonical_season=('canonical_season', 'first'), players=('players', 'sum'), minutes=('minutes', 'sum')).reset_index()
+    shape = np.zeros((len(teams), len(groups) * len(metrics)), dtype=np.float32)
+    shape_valid = np.zeros_like(shape)
+    for g, group in enumerate(groups):
+        in_group = np.flatnonzero((squads['position_group'] == group).to_numpy())
+        block = slice(g * len(metrics), (g + 1) * len(metrics))
+        shape[team_codes[in_group], block] = (profiles[in_group] - 50) / 50
+        shape_valid[team_codes[in_group], block] = 1
+    return {
+        'metrics': metrics, 'pct_suffix': pct_suffix, 'groups': groups, 'squads': squads, 'profiles': profiles, 'teams': teams,
+        'shape_entry': _weighted_entry(shape, shape_valid, np.ones(shape.shape[1], dtype=np.float32), "Weighted Cosine"),
+    }
+
+def squad_profile_series(squad_profiles, team_name, season_name, position_group):
+    """A squad's percentile profile shaped like a player row, so create_plotly_radar can draw it; None when absent."""
+    squads = squad_profiles['squads']
+    found = np.flatnonzero(((squads['team_name'] == team_name) & (squads['season_name'] == season_name) &
+                            (squads['position_group'] == position_group)).to_numpy())
+    if len(found) == 0:
+        return None
+    profile = pd.Series(squad_profiles['profiles'][found[0]], index=[f"{m}{squad_profiles['pct_suffix']}" for m in squad_profiles['metrics']])
+    return pd.concat([pd.Series({'player_name': team_name, 'season_name': season_name}), profile])
+
+def similar_squads(squad_profiles, team_name, season_name, groups=None, seasons=None, competition_ids=None, top_k=20):
+    """
+    Team-seasons ranked by masked cosine similarity of their squad shape to a team-season's, over
+    the position groups both squads have (restricted to `groups` if given); other seasons of the
+    same club are excluded.
+    """
+    teams, entry = squad_profiles['teams'], squad_profiles['shape_entry']
+    found = np.flatnonzero(((teams['team_name'] == team_name) & (teams['season_name'] == season_name)).to_numpy())
+    if len(found) == 0:
+        return pd.DataFrame()
+    target_valid = entry['valid'][found[0]].copy()
+    if groups is not None:
+        selected = np.repeat(np.isin(squad_profiles['groups'], groups), len(squad_profiles['metrics']))
+        target_valid *= selected
+    similarity, overlap = masked_similarity(entry, entry['matrix'][found[0]], target_valid)
+    pool = (overlap >= np.ceil(MIN_METRIC_OVERLAP * target_valid.sum())) & (overlap > 0) & (teams['team_name'] != team_name).to_numpy()
+    if seasons is not None:
+        pool &= teams['canonical_season'].isin(list(seasons)).to_numpy()
+    if competition_ids is not None:
+        pool &= teams['competition_id'].isin(competition_ids).to_numpy()
+    candidates = np.flatnonzero(pool)
+    if top_k is not None and top_k < len(candidates):
+        candidates = candidates[np.argpartition(-similarity[candidates], top_k - 1)[:top_k]]
+    candidates = candidates[np.argsort(-similarity[candidates], kind='stable')]
+    matches = teams.iloc[candidates].copy()
+    matches.attrs['pool_size'] = int(pool.sum())
+    matches['squad_similarity'] = similarity[candidates] * 100
+    matches['groups_compared'] = (overlap[candidates] // len(squad_profiles['metrics'])).astype(int)
+    return matches
+
+@st.cache_resource(ttl=3600)
+def get_query_table(_df, dataset_version):
+    """
+    Column arrays of `_df` for threshold queries, extracted on first use, and a fixed row sample
+    for selectivity estimates, kept per dataset version.
+    """
+    rng = np.random.default_rng(0)
+    return {'df': _df, 'n': len(_df), 'columns': {}, 'selectivity': {}, 'requested': set(),
+            'sample': np.sort(rng.choice(len(_df), min(QUERY_SAMPLE_ROWS, len(_df)), replace=False))}
+
+def _query_column(table, column):
+    if column not in table['columns']:
+        values = table['df'][column]
+        table['columns'][column] = values.to_numpy(dtype=float) if pd.api.types.is_numeric_dtype(values) else values.to_numpy()
+    return table['columns'][column]
+
+def _evaluate_clause(table, clause, rows=None):
+    """Boolean mask of a (column, operator, value) clause over `rows` (all rows by default); 'in' takes a tuple; NaN never matches."""
+    column, operator, value = clause
+    values = _query_column(table, column)
+    values = values if rows is None else values[rows]
+    if operator == 'in':
+        return np.isin(values, list(value))
+    with np.errstate(invalid='ignore'):
+        return QUERY_OPERATORS[operator](values, value)
+
+def clause_selectivity(table, clause):
+    """Estimated share of rows a clause keeps, from the table's row sample."""
+    if clause not in table['selectivity']:
+        table['selectivity'][clause] = float(_evaluate_clause(table, clause, table['sample']).mean()) if len(table['sample']) else 1.0
+    return table['selectivity'][clause]
+
+def run_threshold_query(table, clauses, dataset_version):
+    """
+    Row positions satisfying every clause, ANDed most selective first with an early exit. Clauses
+    evaluated over every row (the most selective one, or any clause seen in an earlier query) get
+    their full mask cached in the result cache; the rest are evaluated only over surviving rows.
+    """
+    clauses = sorted(set(clauses), key=lambda c: clause_selectivity(table, c))
+    survivors = np.arange(table['n'])
+    for i, clause in enumerate(clauses):
+        if i == 0 or clause in table['requested']:
+            mask = cached_result(('clause', dataset_version, clause), dataset_version, lambda: _evaluate_clause(table, clause))
+            survivors = survivors[mask[survivors]]
+        elif len(survivors):
+            survivors = survivors[_evaluate_clause(table, clause, survivors)]
+    table['requested'].update(clauses)
+    return survivors
+
+def rank_query_results(df, rows, scores=None, sort_column=None, descending=True):
+    """
+    Orders query result rows by `scores` (an array over all rows of `df`, e.g. affinity or
+    similarity) or by `sort_column`; missing values go last.
+    """
+    values = scores[rows] if scores is not None else df[sort_column].to_numpy()[rows]
+    numeric = pd.api.types.is_numeric_dtype(values)
+    missing = np.isnan(values.astype(float)) if numeric else pd.isna(values)
+    keys = np.where(missing, 0, values.astype(float)) if numeric else np.asarray(pd.Series(values).fillna('').astype(str).rank(method='dense'))
+    order = np.lexsort(((-keys if descending else keys), missing))
+    return rows[order]
+
+def affinity_scores_for_rows(df, affinity, group, archetype):
+    """An archetype's affinity score for every row of `df` in `group` (NaN elsewhere)."""
+    scores = np.full(len(df), np.nan)
+    group_affinity = affinity.get(group)
+    if group_affinity is not None and archetype in group_affinity['archetypes']:
+        scores[group_affinity['store']['rows']] = group_affinity['scores'][:, group_affinity['archetypes'].index(archetype)]
+    return scores
+
+def similarity_scores_for_rows(df, entry, target_player):
+    """Similarity (x 100) of every row of `df` covered by `entry` to the target (NaN elsewhere or below min_overlap)."""
+    scores = np.full(len(df), np.nan)
+    similarity, overlap = masked_similarity(entry, *_target_vector(entry, target_player))
+    scores[entry['rows']] = np.where(overlap >= entry['min_overlap'], similarity * 100, np.nan)
+    return scores
+
+def fit_map_projection(z, method='pca', seed=0):
+    """
+    A 2-D projection of z-score rows: PCA, or Isomap fitted on at most MAP_FIT_SAMPLE rows. Either
+    way the fitted estimator projects further rows with transform(), without refitting.
+    """
+    if method == 'pca':
+        return PCA(n_components=2, random_state=seed).fit(z)
+    sample = np.random.default_rng(seed).choice(len(z), min(MAP_FIT_SAMPLE, len(z)), replace=False)
+    return Isomap(n_components=2, n_neighbors=min(MAP_NEIGHBOURS, len(sample) - 1)).fit(z[sample])
+
+def project_map(model, z, chunk_rows=BATCH_CHUNK_ROWS):
+    """Map coordinates of z-score rows through a fitted projection, in chunks."""
+    coords = [model.transform(z[start:start + chunk_rows]) for start in range(0, len(z), chunk_rows)]
+    return np.vstack(coords).astype(np.float32) if coords else np.empty((0, 2), dtype=np.float32)
+
+@st.cache_resource(ttl=3600)
+def get_map_model(_df, dataset_version, group, metric_space="Standard", method='pca'):
+    """
+    A position group's scouting-map projection of the z-space, fitted once per dataset version,
+    metric space and method, with the coordinates of every row of the group store (None when the
+    group has too few rows).
+    """
+    store = get_metric_store(_df, dataset_version, metric_space).get(group)
+    if store is None or len(store['rows']) < 3:
+        return None
+    model = fit_map_projection(store['z'], method)
+    return {'model': model, 'metrics': store['metrics'], 'coords': project_map(model, store['z']), 'store': store}
+
+@st.cache_resource(ttl=3600)
+def get_projected_partition(_partition_df, partition_version, _df, dataset_version, group, metric_space="Standard", method='pca'):
+    """
+    Map coordinates of a group's rows in another frame (e.g. blended profiles), projected
+    incrementally through the projection already fitted on `_df` instead of refitting; metrics
+    are aligned by name, missing ones at the group mean.
+    """
+    base = get_map_model(_df, dataset_version, group, metric_space, method)
+    store = get_metric_store(_partition_df, partition_version, metric_space).get(group)
+    if base is None or store is None:
+        return None
+    z = np.zeros((len(store['rows']), len(base['metrics'])), dtype=np.float32)
+    for j, m in enumerate(base['metrics']):
+        if m in store['metric_index']:
+            z[:, j] = store['z'][:, store['metric_index'][m]]
+    return {'coords': project_map(base['model'], z), 'store': store}
 
 # --- 6. RADAR CHART FUNCTIONS ---
 
+RADAR_PALETTE = ['#FF0000', '#0000FF', '#00FF00', '#FFA500', '#FFC0CB'] + ["#FFFF00", "#00FFFF", "#800080", "#FFD700"]
+
 def _radar_angles_labels(metrics_dict):
     labels = list(metrics_dict.values())
     metrics = list(metrics_dict.keys())
     return metrics, labels
 
-def _player_percentiles_for_metrics(player_series, metrics):
-    return [float(player_series.get(f"{m}_pct", 0.0)) for m in metrics]
+def _player_percentiles_for_metrics(player_series, metrics, pct_suffix="_pct"):
+    return [float(player_series.get(f"{m}{pct_suffix}", 0.0)) for m in metrics]
 
-def create_plotly_radar(players_data, radar_config, bg_color="#111111"):
+def create_plotly_radar(players_data, radar_config, bg_color="#111111", metric_space="Standard"):
     """Generates a Plotly Figure for a radar chart with multiple players."""
+    pct_suffix = METRIC_SPACES[metric_space]['pct']
     metrics_dict = radar_config['metrics']
-    group_name = radar_config['name']
+    group_name = radar_config['name'] if metric_space == "Standard" else f"{radar_config['name']} ({metric_space})"
     metrics, labels = _radar_angles_labels(metrics_dict)
 
-    palette = ['#FF0000', '#0000FF', '#00FF00', '#FFA500', '#FFC0CB']
-    fallback_palette = ["#FFFF00", "#00FFFF", "#800080", "#FFD700"]
-    full_palette = palette + fallback_palette
-
     fig = go.Figure()
 
     for i, player_series in enumerate(players_data):
         player_name = player_series.get('player_name', 'Unknown')
         season_name = player_series.get('season_name', 'Unknown')
         label = f"{player_name} ({season_name})"
-        color = full_palette[i % len(full_palette)]
+        color = RADAR_PALETTE[i % len(RADAR_PALETTE)]
 
         rgb_color = tuple(int(color[j:j+2], 16) for j in (1, 3, 5))
         rgba_fillcolor = f'rgba({rgb_color[0]}, {rgb_color[1]}, {rgb_color[2]}, 0.2)'
         
-        percentile_values = _player_percentiles_for_metrics(player_series, metrics)
+        percentile_values = _player_percentiles_for_metrics(player_series, metrics, pct_suffix)
         
         trace = go.Scatterpolar(
             r=percentile_values + [percentile_values[0]],
@@ -897,6 +2605,68 @@ def create_plotly_radar(players_data, radar_config, bg_color="#111111"):
     fig.update_layout(height=520)
     return fig, metrics
 
+def _bin_position(table, value):
+    lo, hi = float(table['edges'][0]), float(table['edges'][-1])
+    return float(np.clip((value - lo) / (hi - lo), 0, 1)) * DISTRIBUTION_BINS
+
+def create_distribution_strip(players_data, radar_config, distribution_tables, position_group, bg_color="#111111"):
+    """Heat strip of each radar axis' distribution within the position group, with the players' raw values marked."""
+    metrics, labels = _radar_angles_labels(radar_config['metrics'])
+    rows = [(label, distribution_tables.get((position_group, m)), m) for m, label in zip(metrics, labels)]
+    rows = [row for row in rows if row[1] is not None]
+    if not rows:
+        return None
+
+    fig = go.Figure(go.Heatmap(
+        z=[table['counts'] / max(table['counts'].max(), 1) for _, table, _ in rows],
+        x=np.arange(DISTRIBUTION_BINS) + 0.5,
+        y=[label for label, _, _ in rows],
+        text=[[f"{table['edges'][b]:.2f} - {table['edges'][b + 1]:.2f}: {table['counts'][b]} players" for b in range(DISTRIBUTION_BINS)]
+              for _, table, _ in rows],
+        hoverinfo="text", colorscale="Greys", reversescale=True, showscale=False
+    ))
+    for i, player_series in enumerate(players_data):
+        values = [player_series.get(m) for _, _, m in rows]
+        known = [(label, table, v) for (label, table, _), v in zip(rows, values) if pd.notna(v)]
+        fig.add_trace(go.Scatter(
+            x=[_bin_position(table, v) for _, table, v in known],
+            y=[label for label, _, _ in known],
+            mode="markers", name=player_series.get('player_name', 'Unknown'),
+            marker=dict(symbol="line-ns", size=14, line=dict(width=3, color=RADAR_PALETTE[i % len(RADAR_PALETTE)])),
+            text=[f"{v:.2f} ({value_to_percentile(table, v):.0f}th pct)" for _, table, v in known],
+            hovertemplate="%{y}: %{text}<extra>%{fullData.name}</extra>", showlegend=False
+        ))
+    fig.update_layout(
+        height=40 + 26 * len(rows), margin=dict(t=10, b=10, l=10, r=10),
+        paper_bgcolor=bg_color, plot_bgcolor=bg_color,
+        xaxis=dict(visible=False, range=[0, DISTRIBUTION_BINS]),
+        yaxis=dict(tickfont=dict(size=10, color="white"), autorange="reversed")
+    )
+    return fig
+
+def create_metric_distribution_figure(table, metric, players_data=(), bg_color="#111111"):
+    """Histogram plus ECDF of one metric in one position group, built from its precomputed table."""
+    centres = (table['edges'][:-1] + table['edges'][1:]) / 2
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=centres, y=table['counts'], name="Players", marker_color="#4C78A8",
+                         width=float(table['edges'][1] - table['edges'][0])))
+    fig.add_trace(go.Scatter(x=table['quantiles'], y=DISTRIBUTION_QUANTILES, name="ECDF", yaxis="y2",
+                             mode="lines", line=dict(color="#FFA500", width=2)))
+    for i, player_series in enumerate(players_data):
+        value = player_series.get(metric)
+        if pd.notna(value):
+            fig.add_vline(x=float(value), line=dict(color=RADAR_PALETTE[i % len(RADAR_PALETTE)], width=2),
+                          annotation_text=player_series.get('player_name', ''), annotation_font_color="white")
+    fig.update_layout(
+        title=dict(text=metric_label(metric), font=dict(color="white")),
+        paper_bgcolor=bg_color, plot_bgcolor=bg_color, font=dict(color="white"), height=420,
+        xaxis=dict(title="Raw value", gridcolor="rgba(255,255,255,0.1)"),
+        yaxis=dict(title="Players", gridcolor="rgba(255,255,255,0.1)"),
+        yaxis2=dict(title="Percentile of cohort", overlaying="y", side="right", range=[0, 100]),
+        legend=dict(orientation="h", y=-0.2)
+    )
+    return fig
+
 def render_plotly_with_legend_hover(fig, metrics, height=520, player_names=None):
     """Adds a checkbox to highlight a player and a button to view the radar in a fullscreen dialog."""
     unique_key = fig.layout.title.text.replace(" ", "_").replace(":", "").lower()
@@ -942,14 +2712,81 @@ def get_season_start_year(season_str):
 st.title("⚽ Advanced Multi-Position Player Analysis v12.0")
 
 processed_data = None
+dataset_version = None
+distribution_tables = {}
 with st.spinner("Loading and processing data for all leagues... This may take a minute."):
     raw_data = get_all_leagues_data((USERNAME, PASSWORD))
     if raw_data is not None:
         processed_data = process_data(raw_data)
+        dataset_version = processed_data.attrs['dataset_version']
+        distribution_tables = get_distribution_tables(processed_data, dataset_version)
     else:
         st.error("Failed to load data. Please check credentials and connection.")
 
-scouting_tab, comparison_tab = st.tabs(["Scouting Analysis", "Direct Comparison"])
+scouting_tab, comparison_tab, distribution_tab, squad_tab, leaderboard_tab, map_tab = st.tabs(
+    ["Scouting Analysis", "Direct Comparison", "Metric Distributions", "Squad Replacements", "Archetype Leaderboards", "Scouting Map"])
+
+def get_search_source(blend=None):
+    """The frame and dataset version a search runs over: processed_data, or the blended profiles for (scope, half-life)."""
+    if blend is None:
+        return processed_data, dataset_version
+    search_scope, recency_half_life = blend
+    return (get_blended_profiles(processed_data, dataset_version, search_scope, recency_half_life),
+            get_blended_version(dataset_version, search_scope, recency_half_life))
+
+def render_neighbour_explorer(knn_job, df):
+    """
+    Neighbours of the explored player-season (st.session_state.knn_explore: group, index label of
+    `df`) and the player-seasons listing it, read from the kNN graph; each row hops to its own.
+    """
+    group, label = st.session_state.knn_explore
+    st.subheader(f"Neighbour Explorer: {df.loc[label, 'player_name']} ({df.loc[label, 'season_name']})")
+    if knn_job['error']:
+        st.error(f"Neighbour graph could not be built: {knn_job['error']}")
+        return
+    if knn_job['graph'] is None:
+        st.info("The neighbour graph is still being built in the background; try again in a moment.")
+        return
+    group_graph = knn_job['graph'].get(group)
+    row = _store_rows(group_graph['store'], df, [label])[0] if group_graph is not None else -1
+    if row < 0:
+        st.warning("This player-season is not in the neighbour graph.")
+        return
+    st.caption(f"Nearest {KNN_GRAPH_K} player-seasons by their detected {group} archetype, across all leagues and seasons.")
+    listed_col, listing_col = st.columns(2)
+    for col, title, reverse in ((listed_col, "Most similar", False), (listing_col, f"Lists this player in their top {KNN_GRAPH_K}", True)):
+        with col:
+            st.markdown(f"**{title}**")
+            rows, scores = knn_neighbours(group_graph, row, reverse=reverse)
+            if len(rows) == 0:
+                st.caption("None.")
+            for store_row, score in zip(rows, scores):
+                neighbour = df.iloc[group_graph['store']['rows'][store_row]]
+                label_text = f"{neighbour['player_name']} ({neighbour['team_name']}, {neighbour['season_name']}) · {score:.1f}"
+                if st.button(label_text, key=f"knn_hop_{int(reverse)}_{store_row}"):
+                    st.session_state.knn_explore = (group, neighbour.name)
+                    st.rerun()
+
+def run_match_query(query, top_k):
+    """
+    Re-runs a stored find_matches query, e.g. to fetch further result pages. Exact queries take
+    the target's score vector from the result cache, so only the filters are re-applied.
+    """
+    search_source, search_version = get_search_source(query['blend'])
+    scores = None
+    if query.get('ann') is None:
+        target = query['target_player']
+        scores = cached_result(
+            ('scores', search_version, query['metric_space'], query['entry']['distance'], query['archetype_key'],
+             target['player_id'], target['season_id'], target['competition_id']),
+            dataset_version,
+            lambda: masked_similarity(query['entry'], *_target_vector(query['entry'], target)),
+        )
+    return find_matches(query['target_player'], search_source, query['archetype_config'], query['search_mode'],
+                        query['min_minutes'], query['metric_space'], entry=query['entry'], pool_mask=query['pool_mask'], top_k=top_k,
+                        ann=query.get('ann'), scores=scores, dominance_share=query.get('dominance_share', PARETO_DOMINANCE_SHARE),
+                        best_per_player=query.get('best_per_player', False), diversity=query.get('diversity', 0.0),
+                        explain=query.get('explain', False))
 
 def create_player_filter_ui(data, key_prefix, pos_filter=None):
     leagues = sorted(data['league_name'].dropna().unique())
@@ -975,12 +2812,12 @@ def create_player_filter_ui(data, key_prefix, pos_filter=None):
                     return None
                 season_df = season_df_filtered
 
-            teams = ["All Teams"] + sorted(season_df['team_name'].unique())
+            teams = ["All Teams"] + teams_in_selection(season_df)
             selected_team = st.selectbox("Team", teams, key=f"{key_prefix}_team")
             
             if selected_team:
                 if selected_team != "All Teams":
-                    player_pool = season_df[season_df['team_name'] == selected_team]
+                    player_pool = filter_by_team(season_df, selected_team)
                 else:
                     player_pool = season_df
                 
@@ -1009,31 +2846,123 @@ with scouting_tab:
         selected_pos = st.sidebar.selectbox("1. Select Position", pos_options, key="scout_pos")
         filter_by_pos = st.sidebar.checkbox("Filter dropdowns by position group", value=True, key="pos_filter_toggle")
 
-        league_filter_options = ["All Leagues", "Domestic Leagues", "Scottish Leagues"]
+        league_filter_options = list(LEAGUE_FILTERS.keys())
         selected_league_filter = st.sidebar.selectbox("League Filter", league_filter_options, key="league_filter")
+        selected_metric_space = st.sidebar.selectbox(
+            "Metric Space", list(METRIC_SPACES.keys()), key="metric_space",
+            help="Age-Adjusted ranks each player against their own age band within the position group; "
+                 "League-Adjusted scales per-90 output by league strength before ranking."
+        )
+        selected_distance = st.sidebar.selectbox(
+            "Similarity Measure", SIMILARITY_MEASURES, key="similarity_measure",
+            help="Weighted Cosine compares style (profile shape); Standardised Euclidean also compares output level; "
+                 "Mahalanobis additionally discounts correlated metrics within the position group."
+        )
+        if selected_metric_space == "League-Adjusted":
+            with st.sidebar.expander("League strength coefficients"):
+                coef_table = processed_data.groupby('league_name')['league_coefficient'].first().sort_values(ascending=False)
+                st.dataframe(coef_table.round(3).rename("Coefficient"))
 
         st.sidebar.subheader("Select Target Player")
         min_minutes = st.sidebar.slider("Minimum Minutes Played", 0, 3000, 600, 100)
-        age_range = st.sidebar.slider("Age Range", 16, 40, (16, 40), key="age_range")
+        age_range = st.sidebar.slider("Age Range", 16, 40, (16, 40), key="age_range",
+                                      help="Current age; Age-Adjusted searches filter on the age during each season instead.")
         pos_filter_arg = selected_pos if filter_by_pos else None
         target_player = create_player_filter_ui(processed_data, key_prefix="scout", pos_filter=pos_filter_arg)
 
-        search_mode = st.sidebar.radio("Search Mode", ('Find Similar Players', 'Find Potential Upgrades'), key='scout_mode')
-        search_mode_logic = 'upgrade' if search_mode == 'Find Potential Upgrades' else 'similar'
+        search_mode = st.sidebar.radio("Search Mode", tuple(SEARCH_MODES.keys()), key='scout_mode')
+        search_mode_logic = SEARCH_MODES[search_mode]
+        dominance_share = st.sidebar.slider(
+            "Must beat the target on at least (share of identity metrics)", 0.1, 1.0, PARETO_DOMINANCE_SHARE, 0.05, key='scout_dominance',
+            help="Candidates are grouped into Pareto layers: layer 1 is not bettered on every metric by anyone else in the pool."
+        ) if search_mode_logic == 'pareto' else PARETO_DOMINANCE_SHARE
+        best_per_player = st.sidebar.checkbox("One row per player (best season)", key='scout_dedupe')
+        diversity = st.sidebar.slider(
+            "Result diversity", 0.0, 0.5, 0.0, 0.05, key='scout_diversity',
+            help="Trades a little similarity for variety: each match is penalised by its similarity to those ranked above it."
+        ) if search_mode_logic != 'pareto' else 0.0
+        explain_matches = st.sidebar.checkbox("Show metric contributions", value=True, key='scout_explain')
+        map_pool = st.session_state.map_pool
+        use_map_pool = st.sidebar.checkbox(
+            f"Search only the map selection ({map_pool['count']} {map_pool['group']}s)", key='scout_map_pool',
+            help="Restricts the pool to the players lassoed on the Scouting Map tab."
+        ) if map_pool else False
+
+        with st.sidebar.expander("Custom Search Profile"):
+            use_custom_profile = st.checkbox("Search on a custom profile instead of the detected archetype", key='custom_enabled')
+            saved_profiles = load_custom_profiles()
+            radar_groups = POSITIONAL_CONFIGS[selected_pos]['radars']
+            profile_sources = (["New profile"] + [f"Saved: {name}" for name in saved_profiles]
+                               + [f"Radar: {radar['name']}" for radar in radar_groups.values()])
+            profile_source = st.selectbox("Start from", profile_sources, key='custom_source')
+            if profile_source.startswith("Saved: "):
+                default_weights = saved_profiles[profile_source[len("Saved: "):]]['metric_weights']
+            elif profile_source.startswith("Radar: "):
+                radar = next(r for r in radar_groups.values() if r['name'] == profile_source[len("Radar: "):])
+                default_weights = {m: 1.0 for m in radar['metrics'] if m in ALL_METRICS_TO_PERCENTILE}
+            else:
+                default_weights = {}
+            custom_metrics = st.multiselect("Metrics", ALL_METRICS_TO_PERCENTILE, default=list(default_weights),
+                                            format_func=metric_label, key=f"custom_metrics_{profile_source}")
+            weights_table = st.data_editor(
+                pd.DataFrame({'Metric': [metric_label(m) for m in custom_metrics],
+                              'Weight': [float(default_weights.get(m, 1.0)) for m in custom_metrics]}),
+                column_config={'Weight': st.column_config.NumberColumn(min_value=0.0, help="A weight of 0 leaves the metric out.")},
+                disabled=['Metric'], hide_index=True, key=f"custom_weights_{profile_source}_{'|'.join(custom_metrics)}"
+            )
+            custom_weights = {m: w for m, w in zip(custom_metrics, weights_table['Weight'].fillna(1.0).clip(lower=0.0)) if w > 0}
+            if custom_metrics and not custom_weights:
+                st.warning("Give at least one metric a positive weight.")
+            profile_name = st.text_input("Profile name", value=profile_source.split(": ", 1)[1] if ": " in profile_source else "",
+                                         key=f"custom_name_{profile_source}")
+            if st.button("Save profile", key='custom_save', disabled=not (profile_name and custom_weights)):
+                save_custom_profile(custom_profile_config(profile_name, custom_weights))
+                st.success(f"Saved profile '{profile_name}'.")
+        custom_config = custom_profile_config(profile_name or "Unsaved profile", custom_weights) if use_custom_profile and custom_weights else None
 
         search_scope = st.sidebar.selectbox(
             "Search Scope",
-            ('Last Season Only', 'Last 2 Seasons', 'All Historical Data'),
+            tuple(SEARCH_SCOPES.keys()),
             key='scout_scope'
         )
+        cross_position = st.sidebar.checkbox(
+            "Search across positions", key='scout_cross',
+            help="Compares players of the selected groups on z-scores standardised over the whole dataset, "
+                 "using the target's archetype metrics."
+        )
+        cross_groups = st.sidebar.multiselect(
+            "Position groups to search", list(POSITIONAL_CONFIGS.keys()), default=list(POSITIONAL_CONFIGS.keys()), key='scout_cross_groups'
+        ) if cross_position else None
+        blend_seasons = st.sidebar.checkbox(
+            "Blend seasons into one profile per player", key='scout_blend',
+            help="Rank players instead of player-seasons, using a minutes-weighted profile across the seasons in scope."
+        )
+        recency_half_life = st.sidebar.slider(
+            "Recency half-life (seasons, 0 = no decay)", 0.0, 4.0, 0.0, 0.5, key='scout_half_life'
+        ) if blend_seasons else 0.0
+        use_ann = st.sidebar.checkbox(
+            "Approximate search for large pools", key='scout_ann',
+            help=f"Scores only the nearest clusters of an IVF index when the pool has at least {ANN_MIN_POOL} rows. "
+                 "Smaller pools and upgrade searches are always exact."
+        )
+        if use_ann:
+            with st.sidebar.expander("Approximate search recall"):
+                st.dataframe(get_ann_recall_report(processed_data, dataset_version, selected_metric_space, selected_distance).round(3), hide_index=True)
+        result_cache = get_result_cache()
+        st.sidebar.caption(f"Result cache: {result_cache['hits']} hits, {result_cache['misses']} misses, "
+                           f"{len(result_cache['entries'])}/{RESULT_CACHE_SIZE} entries")
 
         if st.sidebar.button("Analyze Player", type="primary", key="scout_analyze") and target_player is not None:
             st.session_state.analysis_run = True
             st.session_state.target_player = target_player
             st.session_state.radar_players = []
+            st.session_state.matches_page = 0
+            st.session_state.knn_explore = None
+            st.session_state.trajectory_matches = None
 
             config = POSITIONAL_CONFIGS[selected_pos]
             st.session_state.analysis_pos = selected_pos
+            st.session_state.analysis_metric_space = selected_metric_space
             archetypes = config["archetypes"]
 
             target_pos_group = target_player['position_group']
@@ -1041,60 +2970,189 @@ with scouting_tab:
                 st.error("Target player position group could not be determined. Cannot find matches.")
                 st.session_state.matches = pd.DataFrame()
             else:
-                position_pool = processed_data[processed_data['position_group'] == target_pos_group]
-
-                detected_archetype, dna_df = detect_player_archetype(target_player, archetypes)
+                blend = (search_scope, recency_half_life) if blend_seasons else None
+                search_source, search_version = get_search_source(blend)
+                if blend_seasons:
+                    blended_target = search_source[
+                        (search_source['player_id'] == target_player['player_id']) &
+                        (search_source['position_group'] == target_pos_group)
+                    ]
+                    if not blended_target.empty:
+                        target_player = blended_target.iloc[0]
+                        st.session_state.target_player = target_player
+
+                detected_archetype, dna_df = cached_result(
+                    ('archetype', search_version, selected_metric_space, selected_pos,
+                     target_player['player_id'], target_player['season_id'], target_player['competition_id']),
+                    dataset_version,
+                    lambda: lookup_player_archetype(get_archetype_affinity(search_source, search_version, selected_metric_space),
+                                                    search_source, target_player, archetypes, selected_metric_space),
+                )
                 st.session_state.detected_archetype = detected_archetype
                 st.session_state.dna_df = dna_df
 
-                if detected_archetype:
-                    archetype_config = archetypes[detected_archetype]
-                    
-                    canonical_seasons = sorted(position_pool['canonical_season'].unique(), reverse=True)
-                    
-                    seasons_to_search = canonical_seasons
-                    if search_scope == 'Last Season Only':
-                        seasons_to_search = canonical_seasons[:1]
-                    elif search_scope == 'Last 2 Seasons':
-                        seasons_to_search = canonical_seasons[:2]
+                st.session_state.search_profile = custom_config
 
-                    search_pool = position_pool[position_pool['canonical_season'].isin(seasons_to_search)]
-                    
-                    # Apply league filter
-                    if selected_league_filter == "Domestic Leagues" and 'competition_id' in search_pool.columns:
-                        search_pool = search_pool[search_pool['competition_id'].isin(DOMESTIC_LEAGUE_IDS)]
-                    elif selected_league_filter == "Scottish Leagues" and 'competition_id' in search_pool.columns:
-                        search_pool = search_pool[search_pool['competition_id'].isin(SCOTTISH_LEAGUE_IDS)]
-                    
-                    # Apply age filter
-                    unknown_age_count = 0
-                    if 'age' in search_pool.columns:
-                        unknown_age_count = search_pool['age'].isna().sum()
-                        known_ages = search_pool[search_pool['age'].notna()]
-                        filtered_known = known_ages[(known_ages['age'] >= age_range[0]) & (known_ages['age'] <= age_range[1])]
-                        search_pool = pd.concat([filtered_known, search_pool[search_pool['age'].isna()]], ignore_index=True)
-                    
-                    st.session_state.unknown_age_count = unknown_age_count
-                    
-                    matches = find_matches(
-                        target_player,
-                        search_pool,
-                        archetype_config,
-                        search_mode_logic,
-                        min_minutes
-                    )
+                if detected_archetype:
+                    if cross_position:
+                        similarity_index = get_cross_position_index(search_source, search_version, selected_metric_space, selected_distance)
+                        store_group = CROSS_POSITION_GROUP
+                        target_player = cross_position_target(similarity_index['store'][CROSS_POSITION_GROUP], target_player)
+                    else:
+                        similarity_index = get_similarity_index(search_source, search_version, selected_metric_space, selected_distance)
+                        store_group = target_pos_group
+                    if custom_config is not None:
+                        # Custom profiles gather their columns from the group store on the fly
+                        archetype_config = custom_config
+                        archetype_key = (store_group, target_pos_group, f"Custom: {custom_config['name']}", tuple(sorted(custom_config['metric_weights'].items())))
+                        group_store = similarity_index['store'].get(store_group)
+                        entry = compile_archetype_entry(group_store, custom_config, selected_distance) if group_store is not None else None
+                    else:
+                        archetype_config = archetypes[detected_archetype]
+                        if cross_position:
+                            archetype_key = (CROSS_POSITION_GROUP, f"{target_pos_group}: {detected_archetype}")
+                        else:
+                            archetype_key = (target_pos_group, detected_archetype)
+                        entry = get_archetype_entry(similarity_index, *archetype_key, archetype_config)
+                    if entry is None:
+                        matches = pd.DataFrame()
+                    else:
+                        # Blended profiles already cover exactly the seasons in scope
+                        pool_mask = build_pool_mask(
+                            entry, target_player, min_minutes,
+                            seasons=None if blend_seasons else seasons_in_scope(entry['canonical_season'], search_scope),
+                            competition_ids=LEAGUE_FILTERS[selected_league_filter],
+                            age_range=age_range
+                        )
+                        if cross_position:
+                            pool_mask &= np.isin(entry['position_group'], cross_groups)
+                        if use_map_pool:
+                            # Same partition: the exact player-seasons selected; otherwise the selected players
+                            if map_pool['partition'] == search_version:
+                                pool_mask &= np.isin(entry['rows'], map_pool['positions'])
+                            else:
+                                pool_mask &= np.isin(entry['player_id'], map_pool['player_ids'])
+                        st.session_state.unknown_age_count = int(np.isnan(entry['age'][pool_mask]).sum())
+                        st.session_state.match_query = {
+                            'target_player': target_player, 'archetype_config': archetype_config,
+                            'search_mode': search_mode_logic, 'min_minutes': min_minutes, 'dominance_share': dominance_share,
+                            'best_per_player': best_per_player, 'diversity': diversity, 'explain': explain_matches,
+                            'metric_space': selected_metric_space, 'entry': entry, 'pool_mask': pool_mask, 'blend': blend,
+                            'archetype_key': archetype_key, 'cross_position': cross_position,
+                            'ann': get_ann_indexes(search_source, search_version, selected_metric_space, selected_distance).get(archetype_key) if use_ann and not cross_position else None,
+                        }
+                        # Current page plus the next one, so paging forward is usually free
+                        matches = run_match_query(st.session_state.match_query, top_k=2 * MATCHES_PAGE_SIZE)
                     st.session_state.matches = matches
                 else:
                     st.session_state.matches = pd.DataFrame()
             
             st.rerun()
 
+        with st.sidebar.expander("Threshold Query"):
+            query_pct_suffix = METRIC_SPACES[selected_metric_space]['pct']
+            query_fields = {'Age': 'age', 'Minutes': 'minutes'}
+            for m in ALL_METRICS_TO_PERCENTILE:
+                if f"{m}{query_pct_suffix}" in processed_data.columns:
+                    query_fields[f"{metric_label(m)} (percentile)"] = f"{m}{query_pct_suffix}"
+                if m in processed_data.columns:
+                    query_fields[f"{metric_label(m)} (raw)"] = m
+            query_groups = st.multiselect("Position groups", list(POSITIONAL_CONFIGS.keys()), key='query_groups')
+            query_leagues = st.selectbox("Leagues", list(LEAGUE_FILTERS.keys()), key='query_leagues')
+            query_min_minutes = st.number_input("Min. minutes", 0, 5000, 900, step=100, key='query_min_minutes')
+            query_max_age = st.number_input("Max. age (0 = any)", 0, 45, 0, key='query_max_age')
+            predicates = st.data_editor(
+                pd.DataFrame({'Field': pd.Series(dtype=str), 'Operator': pd.Series(dtype=str), 'Value': pd.Series(dtype=float)}),
+                num_rows="dynamic", hide_index=True, key='query_predicates',
+                column_config={'Field': st.column_config.SelectboxColumn(options=list(query_fields)),
+                               'Operator': st.column_config.SelectboxColumn(options=list(QUERY_OPERATORS)),
+                               'Value': st.column_config.NumberColumn()},
+            ).dropna()
+            query_rank = st.selectbox("Rank by", QUERY_RANKINGS, key='query_rank')
+            query_archetype = query_sort = None
+            if query_rank == "Column":
+                query_sort = st.selectbox("Sort column", ['minutes', 'age'] + [query_fields[f] for f in predicates['Field']],
+                                          format_func=lambda c: next((label for label, col in query_fields.items() if col == c), c), key='query_sort')
+            elif query_rank == "Archetype affinity":
+                if len(query_groups) == 1:
+                    query_archetype = st.selectbox("Archetype", list(POSITIONAL_CONFIGS[query_groups[0]]['archetypes']), key='query_archetype')
+                else:
+                    st.caption("Select exactly one position group to rank by archetype affinity.")
+            elif st.session_state.match_query is None or st.session_state.match_query['blend'] is not None:
+                st.caption("Analyse a single-season target first to rank by similarity to it.")
+            query_descending = st.checkbox("Descending", value=True, key='query_descending')
+
+            if st.button("Run Query", key='query_run'):
+                clauses = [(query_fields[field], operator, float(value)) for field, operator, value in predicates.itertuples(index=False)]
+                clauses.append(('minutes', '>=', float(query_min_minutes)))
+                if query_max_age:
+                    clauses.append(('age', '<=', float(query_max_age)))
+                if query_groups:
+                    clauses.append(('position_group', 'in', tuple(query_groups)))
+                if LEAGUE_FILTERS[query_leagues] is not None:
+                    clauses.append(('competition_id', 'in', tuple(LEAGUE_FILTERS[query_leagues])))
+                rows = run_threshold_query(get_query_table(processed_data, dataset_version), clauses, dataset_version)
+
+                query_scores, score_label = None, None
+                if query_archetype is not None:
+                    query_scores = affinity_scores_for_rows(processed_data, get_archetype_affinity(processed_data, dataset_version, selected_metric_space),
+                                                            query_groups[0], query_archetype)
+                    score_label = f"{query_archetype} affinity"
+                elif query_rank == "Similarity to target" and st.session_state.match_query is not None and st.session_state.match_query['blend'] is None:
+                    query_scores = similarity_scores_for_rows(processed_data, st.session_state.match_query['entry'], st.session_state.match_query['target_player'])
+                    score_label = f"Similarity to {st.session_state.match_query['target_player']['player_name']}"
+                st.session_state.query_results = {
+                    'rows': rank_query_results(processed_data, rows, query_scores, query_sort or 'minutes', query_descending),
+                    'scores': query_scores, 'score_label': score_label,
+                    'columns': list(dict.fromkeys(c for c, _, _ in clauses if c not in ('position_group', 'competition_id'))),
+                }
+                st.session_state.query_page = 0
+
+        query_results = st.session_state.query_results
+        if query_results is not None:
+            st.subheader("Threshold Query Results")
+            total = len(query_results['rows'])
+            query_start = st.session_state.query_page * MATCHES_PAGE_SIZE
+            page_positions = query_results['rows'][query_start:query_start + MATCHES_PAGE_SIZE]
+            query_page = processed_data.iloc[page_positions][['player_name', 'age', 'position_group', 'team_name', 'league_name', 'season_name'] +
+                                                             [c for c in query_results['columns'] if c not in ('age',)]].copy()
+            if query_results['scores'] is not None:
+                query_page.insert(1, query_results['score_label'], query_results['scores'][page_positions].round(1))
+            unscored = int(np.isnan(query_results['scores'][query_results['rows']]).sum()) if query_results['scores'] is not None else 0
+            st.caption(f"{total} player-seasons match." + ("" if total else " Loosen a threshold to see results.") +
+                       (f" {unscored} of them cannot be scored (outside the scoring position group) and are listed last." if unscored else ""))
+            st.dataframe(query_page.rename(columns=lambda c: c if ' ' in c else c.replace('_', ' ').title()), hide_index=True, use_container_width=True)
+            query_cols = st.columns([1, 1, 2])
+            with query_cols[0]:
+                if st.button("◀ Previous", key="query_prev", disabled=query_start == 0):
+                    st.session_state.query_page -= 1
+                    st.rerun()
+            with query_cols[1]:
+                if st.button("Next ▶", key="query_next", disabled=query_start + MATCHES_PAGE_SIZE >= total):
+                    st.session_state.query_page += 1
+                    st.rerun()
+            with query_cols[2]:
+                if st.button("Clear query", key="query_clear"):
+                    st.session_state.query_results = None
+                    st.rerun()
+
         if st.session_state.analysis_run and 'target_player' in st.session_state and st.session_state.target_player is not None:
             tp = st.session_state.target_player
             selected_pos = tp['position_group'] if pd.notna(tp['position_group']) else selected_pos
 
             st.header(f"Analysis: {tp['player_name']} ({tp['primary_position']} | {tp['season_name']})")
 
+            if tp.get('season_id') == BLENDED_SEASON_ID:
+                st.caption(f"Blended profile across {int(tp['seasons_blended'])} season(s) and {int(tp['minutes'])} minutes.")
+            if st.session_state.analysis_metric_space == "Age-Adjusted" and pd.notna(tp.get('age_band')):
+                st.caption(f"Percentiles and z-scores relative to {tp['position_group']}s aged {tp['age_band']}.")
+
+            if tp.get('team_count', 1) > 1 and tp.get('season_id') != BLENDED_SEASON_ID:
+                with st.expander(f"Split season: {tp['team_name']} ({int(tp['team_count'])} teams)"):
+                    breakdown = get_team_split_breakdown(get_split_season_rows(raw_data), tp)
+                    breakdown_cols = [c for c in ['team_name', 'minutes', 'primary_position'] if c in breakdown.columns]
+                    st.dataframe(breakdown[breakdown_cols], hide_index=True)
+
             if st.session_state.detected_archetype:
                 st.subheader(f"Detected Archetype: {st.session_state.detected_archetype}")
                 col1, col2 = st.columns([1, 2])
@@ -1107,26 +3165,100 @@ with scouting_tab:
                     arch_cfg = archetypes_cfg.get(st.session_state.detected_archetype)
                     desc = arch_cfg.get("description") if arch_cfg else "Description not found for this archetype under the selected position set."
                     st.write(f"**Description**: {desc}")
+                    if st.session_state.search_profile:
+                        st.info(f"Matches use the custom profile '{st.session_state.search_profile['name']}'. "
+                                f"{st.session_state.search_profile['description']}")
+
+                with st.expander("Best-Fit Clubs"):
+                    fit_cols = st.columns(4)
+                    with fit_cols[0]:
+                        fit_by_group = st.checkbox("Compare with the team's players in this position", value=True, key='fit_by_group')
+                    with fit_cols[1]:
+                        fit_seasons = sorted(processed_data['canonical_season'].dropna().unique(), reverse=True)
+                        fit_season = st.selectbox("Team season", fit_seasons, key='fit_season')
+                    with fit_cols[2]:
+                        fit_leagues = st.selectbox("Leagues", list(LEAGUE_FILTERS.keys()), key='fit_leagues')
+                    with fit_cols[3]:
+                        fit_top_k = st.number_input("Clubs", 5, 100, 15, step=5, key='fit_top_k')
+                    club_fits = team_fit_scores(
+                        get_team_styles(processed_data, dataset_version, st.session_state.analysis_metric_space, fit_by_group),
+                        tp, seasons=[fit_season], competition_ids=LEAGUE_FILTERS[fit_leagues], top_k=int(fit_top_k)
+                    )
+                    if club_fits.empty:
+                        st.warning("No clubs to compare with the current filters.")
+                    else:
+                        st.caption(f"Style fit: cosine similarity of the player's z-scores to each club's minutes-weighted "
+                                   f"{'positional ' if fit_by_group else ''}profile, top {len(club_fits)} of {club_fits.attrs['pool_size']} clubs.")
+                        st.dataframe(club_fits[['team_name', 'league_name', 'season_name', 'fit_score', 'players']].round({'fit_score': 1})
+                                     .rename(columns=lambda c: c.replace('_', ' ').title()), hide_index=True, use_container_width=True)
 
-                st.subheader(f"Top 10 Matches ({search_mode})")
+                st.subheader(f"Top Matches ({search_mode})")
                 if st.session_state.matches is not None and not st.session_state.matches.empty:
                     if st.session_state.get('unknown_age_count', 0) > 0:
                         st.caption(f"Including {st.session_state.unknown_age_count} players with unknown ages.")
                     
-                    display_cols = ['player_name', 'age', 'primary_position', 'team_name', 'league_name', 'season_name']
-                    score_col = 'upgrade_score' if search_mode_logic == 'upgrade' else 'similarity_score'
+                    display_cols = ['player_name', 'age', 'primary_position', 'team_name', 'league_name', 'season_name', 'metrics_compared']
+                    # Columns follow the mode the matches were searched with, not the sidebar's current one
+                    matches_mode = st.session_state.match_query['search_mode']
+                    score_col = 'upgrade_score' if matches_mode in ('upgrade', 'pareto') else 'similarity_score'
                     display_cols.insert(1, score_col)
-
-                    matches_display = st.session_state.matches.head(10)[display_cols].copy()
+                    if matches_mode == 'pareto':
+                        display_cols[1:1] = ['pareto_layer', 'metrics_beaten']
+                    if st.session_state.match_query.get('cross_position'):
+                        display_cols.insert(display_cols.index('primary_position'), 'position_group')
+
+                    matches = st.session_state.matches
+                    pool_size = matches.attrs.get('pool_size', len(matches))
+                    page_start = st.session_state.matches_page * MATCHES_PAGE_SIZE
+                    page_rows = matches.iloc[page_start:page_start + MATCHES_PAGE_SIZE]
+
+                    contribution_cols = [c for c in matches.columns if c.startswith('contribution_')]
+                    if contribution_cols:
+                        display_cols += ['largest_positive_deviation', 'largest_negative_deviation']
+                    matches_display = page_rows[display_cols].copy()
                     matches_display[score_col] = matches_display[score_col].round(1)
-                    st.dataframe(matches_display.rename(columns=lambda c: c.replace('_', ' ').title()), hide_index=True, use_container_width=True)
+                    matches_display = matches_display.rename(columns={'position_group': 'home_group'}).rename(columns=lambda c: c.replace('_', ' ').title())
+                    if contribution_cols:
+                        # Heat strip: each identity metric's share of the score (cosine) or of the distance
+                        strip = page_rows[contribution_cols].rename(columns=lambda c: metric_label(c[len('contribution_'):]))
+                        matches_display = pd.concat([matches_display, strip], axis=1)
+                        distance_shares = st.session_state.match_query['entry']['distance'] != "Weighted Cosine"
+                        styled = matches_display.style.background_gradient(
+                            cmap='RdYlGn_r' if distance_shares else 'RdYlGn', subset=list(strip.columns), axis=None
+                        ).format("{:.0f}", subset=list(strip.columns)).format("{:.1f}", subset=[score_col.replace('_', ' ').title()])
+                        st.dataframe(styled, hide_index=True, use_container_width=True)
+                        st.caption("Metric columns: " + ("share of the squared distance to the target (%)." if distance_shares
+                                   else "points each metric adds to the similarity score.") + " Deviations are z-score differences from the target.")
+                    else:
+                        st.dataframe(matches_display, hide_index=True, use_container_width=True)
+
+                    page_col1, page_col2, page_col3 = st.columns([1, 2, 1])
+                    with page_col1:
+                        if st.button("◀ Previous", key="matches_prev", disabled=page_start == 0):
+                            st.session_state.matches_page -= 1
+                            st.rerun()
+                    with page_col2:
+                        st.caption(f"Showing {page_start + 1}-{page_start + len(page_rows)} of {pool_size} candidates"
+                                   + (" (approximate)" if matches.attrs.get('approximate') else ""))
+                    with page_col3:
+                        if st.button("Next ▶", key="matches_next", disabled=page_start + MATCHES_PAGE_SIZE >= pool_size):
+                            st.session_state.matches_page += 1
+                            needed = (st.session_state.matches_page + 2) * MATCHES_PAGE_SIZE
+                            if len(matches) < min(needed, pool_size) and st.session_state.get('match_query'):
+                                st.session_state.matches = run_match_query(st.session_state.match_query, top_k=needed)
+                            st.rerun()
+
+                    # The neighbour graph indexes processed_data, so blended searches cannot navigate it
+                    knn_job = get_knn_graph_job(processed_data, dataset_version, st.session_state.match_query['metric_space'],
+                                                st.session_state.match_query['entry']['distance']) if st.session_state.match_query['blend'] is None else None
 
                     st.subheader("Add Players to Radar Comparison")
-                    for i, row in st.session_state.matches.head(10).iterrows():
+                    for i, row in page_rows.iterrows():
                         btn_key = f"add_{row['player_id']}_{row['season_id']}"
                         age_str = str(int(row['age'])) if pd.notna(row['age']) else 'N/A'
                         button_label = f"Add {row['player_name']} ({age_str}, {row['team_name']})"
-                        if st.button(button_label, key=btn_key):
+                        add_col, knn_col = st.columns([3, 1])
+                        if add_col.button(button_label, key=btn_key):
                             if not any(
                                 p['player_id'] == row['player_id'] and
                                 p['season_id'] == row['season_id']
@@ -1134,8 +3266,52 @@ with scouting_tab:
                             ):
                                 st.session_state.radar_players.append(row)
                                 st.rerun()
+                        if knn_job is not None and knn_col.button("Neighbours", key=f"knn_{row['player_id']}_{row['season_id']}"):
+                            st.session_state.knn_explore = (row['position_group'], row.name)
+                            st.rerun()
+
+                    if knn_job is not None and st.session_state.knn_explore is not None:
+                        render_neighbour_explorer(knn_job, processed_data)
                 else:
                     st.warning("No matching players found with the current filters.")
+
+                with st.expander("Career Trajectory Matches"):
+                    trajectory_index = get_trajectory_index(processed_data, dataset_version, st.session_state.analysis_metric_space)
+                    group_index = trajectory_index.get(tp['position_group'])
+                    if tp.get('season_id') == BLENDED_SEASON_ID or group_index is None:
+                        st.info("Trajectories are built from individual seasons; analyse a single season to search them.")
+                    else:
+                        archetype_cfg = POSITIONAL_CONFIGS.get(tp['position_group'], {}).get('archetypes', {}).get(st.session_state.detected_archetype, {})
+                        group_metrics = group_index['store']['metrics']
+                        traj_col1, traj_col2, traj_col3 = st.columns(3)
+                        with traj_col1:
+                            trajectory_length = st.radio("Consecutive seasons", TRAJECTORY_LENGTHS, index=len(TRAJECTORY_LENGTHS) - 1, horizontal=True, key='traj_length')
+                        with traj_col2:
+                            trajectory_align = st.radio("Align by", tuple(TRAJECTORY_ALIGNMENTS.keys()), horizontal=True, key='traj_align')
+                        with traj_col3:
+                            trajectory_progression = st.checkbox("Match progression only", key='traj_progression',
+                                                                 help="Compares each season relative to the first one, so the arc matters rather than the level.")
+                        trajectory_metrics = st.multiselect(
+                            "Trajectory metrics", group_metrics, format_func=metric_label, key='traj_metrics',
+                            default=[m for m in archetype_cfg.get('identity_metrics', []) if m in group_metrics]
+                        )
+                        trajectory_measure = st.selectbox("Similarity measure", SIMILARITY_MEASURES[:2], key='traj_measure')
+                        if st.button("Find Similar Trajectories", key='traj_run', disabled=not trajectory_metrics):
+                            st.session_state.trajectory_matches = find_trajectory_matches(
+                                processed_data, trajectory_index, tp, trajectory_metrics, trajectory_length,
+                                TRAJECTORY_ALIGNMENTS[trajectory_align], trajectory_progression, trajectory_measure,
+                                min_minutes=min_minutes,
+                            )
+                        trajectory_matches = st.session_state.trajectory_matches
+                        if trajectory_matches is not None:
+                            if trajectory_matches.empty:
+                                st.warning(f"No comparable trajectories: {tp['player_name']} needs {trajectory_length} consecutive seasons "
+                                           f"ending in {tp['season_name']}, and candidates need the same.")
+                            else:
+                                st.caption(f"Best window of {len(trajectory_matches)} of {trajectory_matches.attrs['pool_size']} players.")
+                                trajectory_cols = ['player_name', 'trajectory_score', 'trajectory_seasons', 'trajectory_ages', 'team_name', 'league_name']
+                                st.dataframe(trajectory_matches[trajectory_cols].round({'trajectory_score': 1}).rename(columns=lambda c: c.replace('_', ' ').title()),
+                                             hide_index=True, use_container_width=True)
             
             if st.session_state.radar_players:
                 st.subheader("Players on Radar")
@@ -1153,9 +3329,11 @@ with scouting_tab:
                             st.rerun()
 
             st.subheader("Player Radars")
+            analysis_metric_space = st.session_state.get("analysis_metric_space", "Standard")
             players_to_show = [st.session_state.target_player] + st.session_state.radar_players
 
             if selected_pos and selected_pos in POSITIONAL_CONFIGS:
+                show_strips = st.toggle("Show distribution strips", value=True, key="scout_strips")
                 radars_to_show = POSITIONAL_CONFIGS[selected_pos]['radars']
                 num_radars = len(radars_to_show)
                 cols = st.columns(3)
@@ -1165,8 +3343,11 @@ with scouting_tab:
                     with cols[i % 3]:
                         radar_key, radar_config = radar_items[i]
                         player_names = [p['player_name'] for p in players_to_show]
-                        fig, metrics = create_plotly_radar(players_to_show, radar_config)
+                        fig, metrics = create_plotly_radar(players_to_show, radar_config, metric_space=analysis_metric_space)
                         render_plotly_with_legend_hover(fig, metrics, height=520, player_names=player_names)
+                        strip = create_distribution_strip(players_to_show, radar_config, distribution_tables, selected_pos) if show_strips else None
+                        if strip is not None:
+                            st.plotly_chart(strip, use_container_width=True, key=f"scout_strip_{radar_key}")
             else:
                  st.warning("Select a player and run analysis to see radar charts.")
         
@@ -1209,7 +3390,7 @@ with comparison_tab:
 
             if state.get('season'):
                 season_df = data[(data['league_name'] == state['league']) & (data['season_name'] == state['season'])]
-                teams = ["All Teams"] + sorted(season_df['team_name'].unique())
+                teams = ["All Teams"] + teams_in_selection(season_df)
                 team_idx = teams.index(state['team']) if state.get('team') in teams else 0
                 selected_team = st.selectbox("Team", teams, key=f"{key_prefix}_team", index=team_idx)
 
@@ -1220,11 +3401,10 @@ with comparison_tab:
             
             if state.get('team'):
                 if state['team'] != "All Teams":
-                    player_pool = data[
+                    player_pool = filter_by_team(data[
                         (data['league_name'] == state['league']) & 
-                        (data['season_name'] == state['season']) & 
-                        (data['team_name'] == state['team'])
-                    ]
+                        (data['season_name'] == state['season'])
+                    ], state['team'])
                 else:
                     player_pool = data[
                         (data['league_name'] == state['league']) & 
@@ -1289,6 +3469,60 @@ with comparison_tab:
                         st.session_state.comparison_players.pop(i)
                         st.rerun()
 
+        if len(st.session_state.comparison_players) >= 2:
+            with st.expander("Find players like a blend of these players"):
+                contributors = st.session_state.comparison_players
+                contributor_groups = [p['position_group'] for p in contributors if p['position_group'] in POSITIONAL_CONFIGS]
+                composite_groups = list(POSITIONAL_CONFIGS.keys())
+                default_group = max(set(contributor_groups), key=contributor_groups.count) if contributor_groups else composite_groups[0]
+                blend_cols = st.columns(3)
+                with blend_cols[0]:
+                    composite_group = st.selectbox("Search Position Group", composite_groups, index=composite_groups.index(default_group), key="composite_group")
+                with blend_cols[1]:
+                    composite_archetype = st.selectbox("Archetype", ["Union of detected archetypes"] + list(POSITIONAL_CONFIGS[composite_group]['archetypes']), key="composite_archetype")
+                with blend_cols[2]:
+                    composite_objective = st.radio("Objective", list(COMPOSITE_OBJECTIVES.keys()), key="composite_objective", horizontal=True,
+                                                   help="Weighted centroid matches the blended profile; Max coverage ranks by the weakest similarity to any contributor.")
+
+                weight_cols = st.columns(len(contributors))
+                composite_weights = []
+                for i, contributor in enumerate(contributors):
+                    with weight_cols[i]:
+                        composite_weights.append(st.slider(f"{contributor['player_name']} ({contributor['season_name']})", 0.0, 1.0, 1.0, 0.1,
+                                                           key=f"composite_weight_{contributor['player_id']}_{contributor['season_id']}"))
+
+                filter_cols = st.columns(4)
+                with filter_cols[0]:
+                    composite_space = st.selectbox("Metric Space", list(METRIC_SPACES.keys()), key="composite_metric_space")
+                with filter_cols[1]:
+                    composite_scope = st.selectbox("Search Scope", tuple(SEARCH_SCOPES.keys()), key="composite_scope")
+                with filter_cols[2]:
+                    composite_league_filter = st.selectbox("Search Leagues", list(LEAGUE_FILTERS.keys()), key="composite_league_filter")
+                with filter_cols[3]:
+                    composite_min_minutes = st.number_input("Min. minutes", 0, 3000, 600, step=100, key="composite_min_minutes")
+
+                if st.button("Find Blended Matches", type="primary", key="composite_run", disabled=sum(composite_weights) == 0):
+                    st.session_state.composite_matches = find_composite_matches(
+                        contributors, processed_data, get_similarity_index(processed_data, dataset_version, composite_space), composite_group,
+                        archetype_name=None if composite_archetype == "Union of detected archetypes" else composite_archetype,
+                        weights=composite_weights, objective=COMPOSITE_OBJECTIVES[composite_objective], metric_space=composite_space,
+                        min_minutes=composite_min_minutes, search_scope=composite_scope, competition_ids=LEAGUE_FILTERS[composite_league_filter],
+                        affinity=get_archetype_affinity(processed_data, dataset_version, composite_space),
+                    )
+
+                composite_matches = st.session_state.composite_matches
+                if composite_matches is not None:
+                    if composite_matches.empty:
+                        st.warning("No blended matches found with the current filters.")
+                    else:
+                        similarity_cols = [c for c in composite_matches.columns if c.startswith('similarity_to_')]
+                        composite_display = composite_matches[['player_name', 'composite_score', 'age', 'team_name', 'league_name', 'season_name'] + similarity_cols]
+                        composite_display = composite_display.rename(columns={
+                            f'similarity_to_{i}': f"vs {name}" for i, name in enumerate(composite_matches.attrs['contributors'])
+                        }).rename(columns=lambda c: c.replace('_', ' ').title() if not c.startswith('vs ') else c)
+                        st.caption(f"Archetype: {composite_matches.attrs['archetype']} | {composite_matches.attrs['pool_size']} candidates")
+                        st.dataframe(composite_display.round(1), use_container_width=True, hide_index=True)
+
         st.divider()
         
         if st.session_state.comparison_players:
@@ -1304,8 +3538,10 @@ with comparison_tab:
             default_index = radar_pos_options.index(default_pos) if default_pos in radar_pos_options else 0
             
             selected_radar_pos = st.selectbox("Select Radar Set to Use for Comparison", radar_pos_options, index=default_index)
+            comp_metric_space = st.radio("Metric Space", list(METRIC_SPACES.keys()), horizontal=True, key="comp_metric_space")
             
             if selected_radar_pos:
+                show_comp_strips = st.toggle("Show distribution strips", value=True, key="comp_strips")
                 radars_to_show = POSITIONAL_CONFIGS[selected_radar_pos]['radars']
                 
                 num_radars = len(radars_to_show)
@@ -1316,9 +3552,293 @@ with comparison_tab:
                     with cols[i % 3]:
                         radar_key, radar_config = radar_items[i]
                         player_names_for_hover = [p['player_name'] for p in st.session_state.comparison_players]
-                        fig, metrics = create_plotly_radar(st.session_state.comparison_players, radar_config)
+                        fig, metrics = create_plotly_radar(st.session_state.comparison_players, radar_config, metric_space=comp_metric_space)
                         render_plotly_with_legend_hover(fig, metrics, height=520, player_names=player_names_for_hover)
+                        strip = create_distribution_strip(st.session_state.comparison_players, radar_config, distribution_tables, selected_radar_pos) if show_comp_strips else None
+                        if strip is not None:
+                            st.plotly_chart(strip, use_container_width=True, key=f"comp_strip_{radar_key}")
+    else:
+        st.error("Data could not be loaded. Please check your credentials in the script.")
+
+with distribution_tab:
+    st.header("Metric Distributions")
+
+    if distribution_tables:
+        dist_groups = [g for g in POSITIONAL_CONFIGS if any(key[0] == g for key in distribution_tables)]
+        dist_col1, dist_col2 = st.columns(2)
+        with dist_col1:
+            dist_group = st.selectbox("Position Group", dist_groups, key="dist_group")
+        group_metrics = sorted({m for (g, m) in distribution_tables if g == dist_group}, key=metric_label)
+        with dist_col2:
+            dist_metric = st.selectbox("Metric", group_metrics, format_func=metric_label, key="dist_metric")
+
+        table = distribution_tables.get((dist_group, dist_metric))
+        if table is not None:
+            players_in_view = [p for p in ([st.session_state.target_player] if st.session_state.target_player is not None else [])
+                               + st.session_state.radar_players + st.session_state.comparison_players
+                               if p.get('position_group') == dist_group]
+            st.plotly_chart(create_metric_distribution_figure(table, dist_metric, players_in_view), use_container_width=True)
+
+            lookup_col1, lookup_col2 = st.columns(2)
+            with lookup_col1:
+                pct_query = st.slider("Percentile", 0, 100, 78, key="dist_pct_query")
+                st.metric(f"Raw value at the {pct_query}th percentile", f"{percentile_to_value(table, pct_query):.3f}")
+            with lookup_col2:
+                value_query = st.number_input("Raw value", value=float(table['quantiles'][50]), key="dist_value_query")
+                st.metric("Percentile of that value", f"{value_to_percentile(table, value_query):.0f}")
+            st.caption(f"{table['n']} {dist_group}s in the cohort. "
+                       + ("Lower values are better for this metric." if table['negative'] else ""))
+    else:
+        st.error("Data could not be loaded. Please check your credentials in the script.")
+
+with squad_tab:
+    st.header("Squad Replacement Search")
+
+    if processed_data is not None:
+        squad_cols = st.columns(3)
+        with squad_cols[0]:
+            squad_league = st.selectbox("League", sorted(processed_data['league_name'].dropna().unique()), key="squad_league", index=None, placeholder="Choose a league")
+        squad_df = processed_data[processed_data['league_name'] == squad_league]
+        with squad_cols[1]:
+            squad_season = st.selectbox("Season", sorted(squad_df['season_name'].unique(), key=get_season_start_year, reverse=True), key="squad_season", index=None, placeholder="Choose a season")
+        squad_df = squad_df[squad_df['season_name'] == squad_season]
+        with squad_cols[2]:
+            squad_team = st.selectbox("Team", teams_in_selection(squad_df), key="squad_team", index=None, placeholder="Choose a team")
+
+        option_cols = st.columns(6)
+        with option_cols[0]:
+            squad_space = st.selectbox("Metric Space", list(METRIC_SPACES.keys()), key="squad_metric_space")
+        with option_cols[1]:
+            squad_distance = st.selectbox("Similarity Measure", SIMILARITY_MEASURES, key="squad_similarity_measure")
+        with option_cols[2]:
+            squad_scope = st.selectbox("Search Scope", tuple(SEARCH_SCOPES.keys()), key="squad_scope")
+        with option_cols[3]:
+            squad_league_filter = st.selectbox("Search Leagues", list(LEAGUE_FILTERS.keys()), key="squad_league_filter")
+        with option_cols[4]:
+            squad_min_minutes = st.number_input("Min. minutes", 0, 3000, 600, step=100, key="squad_min_minutes")
+        with option_cols[5]:
+            squad_top_k = st.number_input("Matches per player", 1, 50, 5, key="squad_top_k")
+
+        if st.button("Find Replacements", type="primary", key="squad_run", disabled=squad_team is None):
+            squad = filter_by_team(squad_df, squad_team)
+            squad = squad[squad['minutes'] >= squad_min_minutes]
+            with st.spinner(f"Scoring {len(squad)} players..."):
+                st.session_state.squad_replacements = find_replacements_batch(
+                    squad, processed_data, get_similarity_index(processed_data, dataset_version, squad_space, squad_distance), squad_space,
+                    squad_min_minutes, int(squad_top_k), squad_scope, LEAGUE_FILTERS[squad_league_filter],
+                    affinity=get_archetype_affinity(processed_data, dataset_version, squad_space))
+
+        replacements = st.session_state.squad_replacements
+        if replacements is not None:
+            if replacements.empty:
+                st.warning("No replacements found for this squad with the current filters.")
+            else:
+                display_cols = ['target_player_name', 'archetype', 'rank', 'player_name', 'age', 'primary_position',
+                                'team_name', 'league_name', 'season_name', 'minutes', 'similarity_score', 'metrics_compared']
+                st.caption(f"{replacements['target_player_name'].nunique()} squad players, {len(replacements)} matches.")
+                st.dataframe(replacements[display_cols].rename(columns={'target_player_name': 'Squad Player', 'archetype': 'Archetype', 'rank': 'Rank',
+                                                                        'player_name': 'Player', 'age': 'Age', 'primary_position': 'Position',
+                                                                        'team_name': 'Team', 'league_name': 'League', 'season_name': 'Season',
+                                                                        'minutes': 'Minutes', 'similarity_score': 'Similarity %',
+                                                                        'metrics_compared': 'Metrics Compared'}),
+                             use_container_width=True, hide_index=True)
+                st.download_button("Download CSV", replacements[display_cols].to_csv(index=False), file_name=f"{squad_team}_replacements.csv", mime="text/csv", key="squad_download")
+
+        if squad_team is not None:
+            with st.expander(f"Players Who Fit {squad_team}'s Style"):
+                team_fit_cols = st.columns(3)
+                with team_fit_cols[0]:
+                    team_fit_by_group = st.checkbox("Compare with the team's players in each position", value=True, key='team_fit_by_group')
+                with team_fit_cols[1]:
+                    team_fit_groups = st.multiselect("Position groups", list(POSITIONAL_CONFIGS.keys()), key='team_fit_groups')
+                with team_fit_cols[2]:
+                    team_fit_top_k = st.number_input("Players", 5, 100, 20, step=5, key='team_fit_top_k')
+                team_fits = players_fit_to_team(
+                    processed_data, get_team_styles(processed_data, dataset_version, squad_space, team_fit_by_group), squad_team, squad_season,
+                    min_minutes=squad_min_minutes, seasons=seasons_in_scope(processed_data['canonical_season'], squad_scope),
+                    competition_ids=LEAGUE_FILTERS[squad_league_filter], position_groups=team_fit_groups or None, top_k=int(team_fit_top_k)
+                )
+                if team_fits.empty:
+                    st.warning("No players to compare with the current filters." +
+                               (f" Positional profiles need {squad_team} players in that position in {squad_season}." if team_fit_by_group else ""))
+                else:
+                    st.caption(f"Top {len(team_fits)} of {team_fits.attrs['pool_size']} players by style fit (search scope, leagues and minutes as above).")
+                    st.dataframe(team_fits[['player_name', 'fit_score', 'age', 'position_group', 'team_name', 'league_name', 'season_name', 'minutes']]
+                                 .round({'fit_score': 1}).rename(columns=lambda c: c.replace('_', ' ').title()), hide_index=True, use_container_width=True)
+
+            squad_profiles = get_squad_profiles(processed_data, dataset_version, squad_space)
+            with st.expander(f"Similar Squads to {squad_team}"):
+                shape_cols = st.columns(3)
+                with shape_cols[0]:
+                    shape_groups = st.multiselect("Compare position groups", squad_profiles['groups'], key='squad_shape_groups',
+                                                  help="Defaults to every group both squads have.")
+                with shape_cols[1]:
+                    shape_leagues = st.selectbox("Leagues", list(LEAGUE_FILTERS.keys()), key='squad_shape_leagues')
+                with shape_cols[2]:
+                    shape_same_season = st.checkbox("Same season only", value=True, key='squad_shape_same_season')
+                squad_canonical = squad_df['canonical_season'].iloc[0] if not squad_df.empty else None
+                similar = similar_squads(squad_profiles, squad_team, squad_season, groups=shape_groups or None,
+                                         seasons=[squad_canonical] if shape_same_season and squad_canonical is not None else None,
+                                         competition_ids=LEAGUE_FILTERS[shape_leagues])
+                if similar.empty:
+                    st.warning("No comparable squads with the current filters.")
+                else:
+                    st.caption(f"Squad shape: minutes-weighted percentile profiles of each position group, top {len(similar)} of {similar.attrs['pool_size']} squads.")
+                    st.dataframe(similar[['team_name', 'league_name', 'season_name', 'squad_similarity', 'groups_compared', 'players']]
+                                 .round({'squad_similarity': 1}).rename(columns=lambda c: c.replace('_', ' ').title()), hide_index=True, use_container_width=True)
+
+            with st.expander(f"{squad_team} Squad Profile"):
+                squads = squad_profiles['squads']
+                squad_rows = squads[(squads['team_name'] == squad_team) & (squads['season_name'] == squad_season)]
+                age_cols = [c for c in squads.columns if c.startswith('minutes_share_')]
+                st.dataframe(squad_rows[['position_group', 'players', 'regulars', 'minutes', 'mean_age'] + age_cols]
+                             .round(1).rename(columns=lambda c: c.replace('minutes_share_', 'Minutes % Age ').replace('_', ' ').title()),
+                             hide_index=True, use_container_width=True)
+                st.caption(f"Regulars played at least {SQUAD_REGULAR_MINUTES} minutes; ages are as of 1 January of the season's end year.")
+                profile_cols = st.columns(2)
+                with profile_cols[0]:
+                    profile_group = st.selectbox("Position group", squad_rows['position_group'].tolist(), key='squad_profile_group')
+                with profile_cols[1]:
+                    compare_options = {"Nobody": None}
+                    if not similar.empty:
+                        compare_options.update({f"{t} ({season})": (t, season) for t, season in zip(similar['team_name'], similar['season_name'])})
+                    compare_with = compare_options[st.selectbox("Compare with", list(compare_options), key='squad_profile_compare')]
+                if profile_group is not None:
+                    profile_series = [squad_profile_series(squad_profiles, squad_team, squad_season, profile_group)]
+                    if compare_with is not None:
+                        profile_series.append(squad_profile_series(squad_profiles, compare_with[0], compare_with[1], profile_group))
+                    profile_series = [p for p in profile_series if p is not None]
+                    radar_cols = st.columns(3)
+                    for i, (radar_key, radar_config) in enumerate(POSITIONAL_CONFIGS[profile_group]['radars'].items()):
+                        with radar_cols[i % 3]:
+                            fig, _ = create_plotly_radar(profile_series, radar_config, metric_space=squad_space)
+                            st.plotly_chart(fig, use_container_width=True, key=f"squad_radar_{radar_key}")
+    else:
+        st.error("Data could not be loaded. Please check your credentials in the script.")
+
+with leaderboard_tab:
+    st.header("Archetype Leaderboards")
+
+    if processed_data is not None:
+        board_cols = st.columns(3)
+        with board_cols[0]:
+            board_group = st.selectbox("Position Group", list(POSITIONAL_CONFIGS.keys()), key="board_group")
+        with board_cols[1]:
+            board_archetype = st.selectbox("Archetype", list(POSITIONAL_CONFIGS[board_group]['archetypes']), key="board_archetype")
+        with board_cols[2]:
+            board_space = st.selectbox("Metric Space", list(METRIC_SPACES.keys()), key="board_metric_space")
+
+        filter_cols = st.columns(5)
+        league_ids = processed_data.groupby('league_name')['competition_id'].first()
+        with filter_cols[0]:
+            board_leagues = st.multiselect("Leagues", sorted(league_ids.index), key="board_leagues", placeholder="All leagues")
+        with filter_cols[1]:
+            # Label each canonical season by the season names behind it (e.g. "2024/2025, 2025" with calendar-year leagues)
+            season_labels = processed_data.groupby('canonical_season')['season_name'].agg(lambda names: ", ".join(sorted(names.unique())))
+            board_seasons = st.multiselect("Seasons", sorted(season_labels.index, reverse=True),
+                                           format_func=lambda season: season_labels[season], key="board_seasons", placeholder="All seasons")
+        with filter_cols[2]:
+            board_age = st.slider("Age Range", 16, 40, (16, 40), key="board_age")
+        with filter_cols[3]:
+            board_min_minutes = st.number_input("Min. minutes", 0, 3000, 900, step=100, key="board_min_minutes")
+        with filter_cols[4]:
+            board_top_k = st.number_input("Show top", 5, 200, 20, step=5, key="board_top_k")
+
+        leaderboard = archetype_leaderboard(
+            processed_data, get_archetype_affinity(processed_data, dataset_version, board_space), board_group, board_archetype,
+            top_k=int(board_top_k), min_minutes=board_min_minutes, seasons=board_seasons or None,
+            competition_ids=league_ids[board_leagues].tolist() if board_leagues else None, age_range=board_age,
+        )
+        if leaderboard.empty:
+            st.warning("No players match these filters.")
+        else:
+            st.caption(f"Top {len(leaderboard)} of {leaderboard.attrs['pool_size']} {board_group}s by affinity to {board_archetype}.")
+            board_display = leaderboard[['rank', 'player_name', 'affinity_score', 'age', 'primary_position', 'team_name', 'league_name', 'season_name', 'minutes']]
+            st.dataframe(board_display.round({'affinity_score': 1}).rename(columns=lambda c: c.replace('_', ' ').title()),
+                         use_container_width=True, hide_index=True)
     else:
         st.error("Data could not be loaded. Please check your credentials in the script.")
 
+with map_tab:
+    st.header("Scouting Map")
+
+    if processed_data is not None:
+        map_cols = st.columns(4)
+        with map_cols[0]:
+            map_group = st.selectbox("Position Group", list(POSITIONAL_CONFIGS.keys()), key="map_group")
+        with map_cols[1]:
+            map_space = st.selectbox("Metric Space", list(METRIC_SPACES.keys()), key="map_metric_space")
+        with map_cols[2]:
+            map_method = st.selectbox("Projection", list(MAP_METHODS.keys()), key="map_method",
+                                      help="Fitted once per dataset version; Isomap is fitted on a sample and projects the rest.")
+        with map_cols[3]:
+            map_source = st.radio("Points", ("Player-seasons", "Blended profiles"), key="map_source", horizontal=True)
+
+        filter_cols = st.columns(3)
+        with filter_cols[0]:
+            map_scope = st.selectbox("Search Scope", tuple(SEARCH_SCOPES.keys()), key="map_scope")
+        with filter_cols[1]:
+            map_league_filter = st.selectbox("League Filter", tuple(LEAGUE_FILTERS.keys()), key="map_leagues")
+        with filter_cols[2]:
+            map_min_minutes = st.number_input("Min. minutes", 0, 3000, 600, step=100, key="map_min_minutes")
+
+        blended = map_source == "Blended profiles"
+        map_df, map_version = get_search_source((map_scope, 0.0) if blended else None)
+        if blended:
+            # Blended profiles are projected through the player-season map, not refitted
+            projection = get_projected_partition(map_df, map_version, processed_data, dataset_version, map_group,
+                                                 map_space, MAP_METHODS[map_method])
+        else:
+            projection = get_map_model(processed_data, dataset_version, map_group, map_space, MAP_METHODS[map_method])
 
+        if projection is None:
+            st.warning(f"Not enough {map_group}s to build a map.")
+        else:
+            map_store = projection['store']
+            group_affinity = get_archetype_affinity(map_df, map_version, map_space)[map_group]
+            shown = build_pool_mask(map_store, None, map_min_minutes,
+                                    seasons=None if blended else seasons_in_scope(map_store['canonical_season'], map_scope),
+                                    competition_ids=LEAGUE_FILTERS[map_league_filter])
+            archetype_ids = group_affinity['scores'].argmax(axis=1)
+            map_rows = map_df.iloc[map_store['rows']]
+            hover = (map_rows['player_name'].astype(str) + " (" + map_rows['season_name'].astype(str) + ", "
+                     + map_rows['team_name'].astype(str) + ")").to_numpy()
+
+            fig = go.Figure()
+            trace_rows = []
+            for a, archetype in enumerate(group_affinity['archetypes']):
+                rows = np.flatnonzero(shown & (archetype_ids == a))
+                trace_rows.append(rows)
+                fig.add_trace(go.Scattergl(
+                    x=projection['coords'][rows, 0], y=projection['coords'][rows, 1], mode='markers', name=archetype,
+                    text=hover[rows], hovertemplate="%{text}<extra>" + archetype + "</extra>", marker=dict(size=5, opacity=0.7)
+                ))
+            fig.update_layout(height=650, dragmode='lasso', xaxis=dict(showticklabels=False, title=None),
+                              yaxis=dict(showticklabels=False, title=None), legend=dict(title="Strongest archetype"))
+            st.caption(f"{int(shown.sum())} {map_group} {'profiles' if blended else 'player-seasons'}, coloured by strongest archetype. "
+                       "Lasso or box-select a region to build a search pool.")
+            event = st.plotly_chart(fig, use_container_width=True, key="map_chart", on_select="rerun", selection_mode=("lasso", "box"))
+
+            points = event.selection.points if event else []
+            selected = np.unique([trace_rows[p['curve_number']][p['point_index']] for p in points
+                                  if p['curve_number'] < len(trace_rows)]).astype(np.int64)
+            if len(selected):
+                selection = map_df.iloc[map_store['rows'][selected]]
+                st.markdown(f"**{len(selected)} selected** ({selection['player_id'].nunique()} players)")
+                st.dataframe(selection[['player_name', 'age', 'team_name', 'league_name', 'season_name', 'minutes']]
+                             .rename(columns=lambda c: c.replace('_', ' ').title()), use_container_width=True, hide_index=True, height=250)
+                if st.button("Use selection as search pool", key="map_use_pool", type="primary"):
+                    st.session_state.map_pool = {
+                        'group': map_group, 'partition': map_version, 'positions': map_store['rows'][selected],
+                        'player_ids': selection['player_id'].unique(), 'count': len(selected),
+                    }
+                    st.rerun()
+            if st.session_state.map_pool:
+                map_pool = st.session_state.map_pool
+                st.info(f"Search pool: {map_pool['count']} {map_pool['group']}s from the map. "
+                        "Enable 'Search only the map selection' in the scouting sidebar to use it.")
+                if st.button("Clear search pool", key="map_clear_pool"):
+                    st.session_state.map_pool = None
+                    st.rerun()
+    else:
+        st.error("Data could not be loaded. Please check your credentials in the script.")
@@ -0,0 +1,64 @@
+import importlib.util
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+import requests
+
+APP_PATH = Path(__file__).resolve().parents[1] / "multipositionalradar.py"
+
+
+@pytest.fixture(scope="module")
+def mpr():
+    """The app module, imported offline (the data load fails fast and the script renders its error state)."""
+    os.environ.setdefault("STATSBOMB_USERNAME", "test")
+    os.environ.setdefault("STATSBOMB_PASSWORD", "test")
+
+    def offline(*args, **kwargs):
+        raise requests.exceptions.ConnectionError("offline")
+
+    original_get, requests.get = requests.get, offline
+    try:
+        spec = importlib.util.spec_from_file_location("multipositionalradar", APP_PATH)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        requests.get = original_get
+    return module
+
+
+def _pool(mpr, metrics, values):
+    suffixes = mpr.METRIC_SPACES["Standard"]
+    df = pd.DataFrame({"player_id": np.arange(len(values)), "position_group": "Center Midfielder",
+                       "season_id": 1, "competition_id": 1, "canonical_season": 2025, "minutes": 1500, "age": 25.0})
+    for j, metric in enumerate(metrics):
+        df[f"{metric}{suffixes['z']}"] = [row[j] for row in values]
+        df[f"{metric}{suffixes['pct']}"] = 50.0
+    return df
+
+
+def test_key_weights_change_the_ranking(mpr):
+    metrics = ["npg_90", "xa_90", "aerial_wins_90"]
+    # Target, a candidate close on the first metric and one close on the second
+    df = _pool(mpr, metrics, [(1.0, 1.0, 0.5), (1.0, 0.2, 0.5), (0.2, 1.0, 0.5)])
+    store = mpr._build_group_store(df, np.arange(len(df)))
+    target = df.iloc[0]
+
+    rankings = []
+    for key_metric in metrics[:2]:
+        config = {"identity_metrics": metrics, "key_metrics": [key_metric], "key_weight": 3.0}
+        entry = mpr.compile_archetype_entry(store, config)
+        matches = mpr.find_matches(target, df, config, min_minutes=0, entry=entry)
+        rankings.append(matches["player_id"].tolist())
+
+    assert rankings == [[1, 2], [2, 1]]
+
+
+def test_built_in_archetypes_are_weighted(mpr):
+    for group, config in mpr.POSITIONAL_CONFIGS.items():
+        for name, archetype in config["archetypes"].items():
+            assert set(archetype["key_metrics"]) <= set(archetype["identity_metrics"]), (group, name)
+            weights = mpr.archetype_metric_weights(archetype, archetype["identity_metrics"])
+            assert weights.max() == pytest.approx(archetype["key_weight"]) and weights.min() == 1.0, (group, name)